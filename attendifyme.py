@@ -3,12 +3,2152 @@ import face_recognition
 import cv2
 import numpy as np
 import os
+import sys
+import argparse
+import io
+import json
+import hashlib
+import threading
+import time
+import queue
+import multiprocessing
+import csv
+import sqlite3
+import bisect
 import gspread
+from gspread.utils import rowcol_to_a1, a1_to_rowcol
 from oauth2client.service_account import ServiceAccountCredentials
-from datetime import datetime
+from datetime import datetime, timedelta
+from collections import namedtuple, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+
+FaceMatch = namedtuple('FaceMatch', ['prn', 'distance', 'margin'])
+Slot = namedtuple('Slot', ['lecture', 'start', 'end', 'room', 'column'])
+RecognitionResult = namedtuple('RecognitionResult', ['seq', 'locations', 'matches', 'track_ids', 'elapsed_ms', 'source'])
+
+
+class IVFIndex:
+    """Approximate nearest-neighbour index over a FaceGallery: an inverted file of k-means cells.
+
+    Gallery rows are bucketed by their nearest of ``nlist`` centroids; a query is
+    compared exactly against the rows of its ``nprobe`` closest cells only. Raising
+    ``nprobe`` trades latency for recall (``nprobe == nlist`` is exact search).
+    Pure NumPy, CPU only. A trained index can be saved next to the encoding cache
+    and loaded back for the same gallery, so training is not repeated every start.
+    """
+
+    SAVE_FILE = 'ivf_index.npz'
+
+    def __init__(self, nlist=None, nprobe=8, train_iters=10, train_sample=50000, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iters = train_iters
+        self.train_sample = train_sample
+        self.rng = np.random.default_rng(seed)
+        self.centroids = None  # float16: they only pick the cells to probe
+        # Inverted lists in CSR form: the rows of cell c are order[bounds[c]:bounds[c + 1]]
+        self.order = np.empty(0, dtype=np.int32)
+        self.bounds = np.zeros(1, dtype=np.int64)
+
+    @staticmethod
+    def _nearest(vectors, centroids, chunk=16384):
+        """Index of the closest centroid for each vector, computed in chunks to bound memory"""
+        centroids = centroids.astype(np.float32)
+        c_norms = np.einsum('ij,ij->i', centroids, centroids)
+        nearest = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk):
+            block = vectors[start:start + chunk]
+            nearest[start:start + chunk] = np.argmin(c_norms[None, :] - 2.0 * (block @ centroids.T), axis=1)
+        return nearest
+
+    def build(self, matrix):
+        """Train the coarse quantizer on the gallery and bucket every row"""
+        size = len(matrix)
+        nlist = self.nlist or max(1, int(4 * np.sqrt(size)))
+        nlist = min(nlist, max(1, size))
+        sample = matrix[self.rng.choice(size, min(size, max(self.train_sample, nlist)), replace=False)]
+        centroids = sample[self.rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(self.train_iters):
+            nearest = self._nearest(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, sample)
+            counts = np.bincount(nearest, minlength=nlist)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+
+        self.centroids = centroids.astype(np.float16)
+        self.assign(self._nearest(matrix, self.centroids))
+        return self
+
+    def assign(self, cells):
+        """Bucket gallery row i into ``cells[i]``, rebuilding the inverted lists"""
+        self.order = np.argsort(cells, kind='stable').astype(np.int32)
+        self.bounds = np.searchsorted(cells[self.order], np.arange(len(self.centroids) + 1))
+
+    def remove(self, row):
+        """Drop a gallery row from its cell"""
+        found = np.flatnonzero(self.order == row)
+        if not len(found):
+            return
+        position = int(found[0])
+        cell = int(np.searchsorted(self.bounds, position, side='right')) - 1
+        self.order = np.delete(self.order, position)
+        self.bounds[cell + 1:] -= 1
+
+    def shift(self, start, delta):
+        """Renumber rows from ``start`` on by ``delta`` after the gallery spliced rows in or out"""
+        self.order[self.order >= start] += delta
+
+    def add(self, row, vector):
+        """Bucket a new or replaced gallery row"""
+        self.remove(row)
+        cell = int(self._nearest(vector[None, :], self.centroids)[0])
+        self.order = np.insert(self.order, self.bounds[cell + 1], row)
+        self.bounds[cell + 1:] += 1
+
+    @property
+    def nbytes(self):
+        return self.centroids.nbytes + self.order.nbytes + self.bounds.nbytes
+
+    def save(self, path, fingerprint):
+        """Write the trained index, tagged with the fingerprint of the gallery it indexes"""
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, centroids=self.centroids, order=self.order, bounds=self.bounds,
+                     fingerprint=np.frombuffer(fingerprint, dtype=np.uint8))
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, fingerprint, **kwargs):
+        """The index saved at ``path`` if it was built over a gallery with this fingerprint, else None"""
+        try:
+            with np.load(path) as saved:
+                if saved['fingerprint'].tobytes() != fingerprint:
+                    return None
+                index = cls(**kwargs)
+                index.centroids, index.order, index.bounds = saved['centroids'], saved['order'], saved['bounds']
+        except (OSError, ValueError, KeyError):
+            return None
+        return index
+
+    def search(self, matrix, sq_norms, queries, k=2, scales=None):
+        """Return (rows, distances) of the k nearest rows found for each query; missing slots are -1/inf.
+
+        ``matrix`` may be a quantized gallery matrix, with ``scales`` holding each row's scale.
+        """
+        nprobe = min(self.nprobe, len(self.centroids))
+        centroids = self.centroids.astype(np.float32)
+        centroid_dists = np.einsum('ij,ij->i', centroids, centroids)[None, :] - 2.0 * (queries @ centroids.T)
+        if nprobe < len(self.centroids):
+            probes = np.argpartition(centroid_dists, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(nprobe), (len(queries), nprobe))
+
+        rows_out = np.full((len(queries), k), -1, dtype=np.int64)
+        dists_out = np.full((len(queries), k), np.inf, dtype=np.float32)
+        for q, (query, cells) in enumerate(zip(queries, probes)):
+            rows = np.concatenate([self.order[self.bounds[cell]:self.bounds[cell + 1]] for cell in cells])
+            if len(rows) == 0:
+                continue
+            dots = matrix[rows].astype(np.float32) @ query
+            if scales is not None:
+                dots *= scales[rows]
+            sq = sq_norms[rows] + query @ query - 2.0 * dots
+            top = np.argpartition(sq, min(k, len(rows)) - 1)[:k] if len(rows) > k else np.arange(len(rows))
+            top = top[np.argsort(sq[top])]
+            rows_out[q, :len(top)] = rows[top]
+            dists_out[q, :len(top)] = np.sqrt(np.maximum(sq[top], 0.0))
+        return rows_out, dists_out
+
+
+class FaceGallery:
+    """Known face encodings packed into one contiguous matrix.
+
+    A student may have several reference encodings. They are stored contiguously:
+    student ``i`` is ``prns[i]`` and owns rows ``offsets[i]:offsets[i + 1]`` of
+    ``matrix``. Matching every face detected in a frame is a single batched distance
+    computation, either against every sample with the closest sample deciding
+    (``mode='nearest'``) or against one mean encoding per student
+    (``mode='centroid'``, which stores only the mean).
+
+    ``storage`` picks the matrix dtype: float32, float16, or int8 with a per-row
+    scale. Quantized rows are matched as stored, so a 100k gallery fits in about
+    14 MB as int8. Very large galleries can swap the exact scan for an approximate
+    index with ``use_index``.
+    """
+
+    MODES = ('nearest', 'centroid')
+    STORAGE = ('float32', 'float16', 'int8')
+    CHUNK_ROWS = 16384  # Rows dequantized at a time while matching
+
+    def __init__(self, dim=128, mode='nearest', storage='float32'):
+        if mode not in self.MODES:
+            raise ValueError(f"unknown matching mode: {mode}")
+        if storage not in self.STORAGE:
+            raise ValueError(f"unknown gallery storage: {storage}")
+        self.dim = dim
+        self.mode = mode
+        self.storage = storage
+        self.prns = []
+        self.rows = {}
+        self.offsets = np.zeros(1, dtype=np.int32)
+        self._matrix = np.empty((0, dim), dtype=storage)
+        self._scales = np.empty(0, dtype=np.float32) if storage == 'int8' else None
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self.max_samples = 0
+        self.index = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.prns)
+
+    @property
+    def samples(self):
+        return int(self.offsets[-1])
+
+    @property
+    def matrix(self):
+        """Stored (possibly quantized) rows; see decode() for float32 values"""
+        return self._matrix[:self.samples]
+
+    @property
+    def scales(self):
+        return self._scales[:self.samples] if self._scales is not None else None
+
+    @property
+    def nbytes(self):
+        """Memory held by the matching arrays, including the index if one is used"""
+        arrays = (self.matrix, self._sq_norms[:self.samples], self.offsets)
+        total = sum(array.nbytes for array in arrays) + (self.scales.nbytes if self._scales is not None else 0)
+        return total + (self.index.nbytes if self.index is not None else 0)
+
+    def _prepare(self, samples):
+        """Float32 rows to store for one student's samples"""
+        block = np.asarray(samples, dtype=np.float32).reshape(-1, self.dim)
+        if self.mode == 'centroid' and len(block) > 1:
+            block = block.mean(axis=0, keepdims=True)
+        return block
+
+    def quantize(self, block):
+        """(stored rows, per-row scales or None) for float32 rows"""
+        if self.storage != 'int8':
+            return block.astype(self.storage), None
+        scales = np.abs(block).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.rint(block / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def decode(self, start=0, end=None):
+        """Float32 values of rows start:end"""
+        block = self._matrix[start:self.samples if end is None else end].astype(np.float32)
+        if self._scales is not None:
+            block *= self._scales[start:start + len(block), None]
+        return block
+
+    @classmethod
+    def from_encodings(cls, encodings, dim=128, mode='nearest', storage='float32'):
+        """Build a gallery from a {prn: encoding or list of encodings} dict in one allocation"""
+        gallery = cls(dim, mode, storage)
+        blocks = {}
+        for prn, samples in encodings.items():
+            block = gallery._prepare(samples)
+            if len(block):
+                blocks[prn] = block
+        prns = list(blocks)
+        counts = np.array([len(blocks[prn]) for prn in prns], dtype=np.int32)
+        offsets = np.zeros(len(prns) + 1, dtype=np.int32)
+        np.cumsum(counts, out=offsets[1:])
+
+        matrix = np.empty((offsets[-1], dim), dtype=storage)
+        scales = np.empty(offsets[-1], dtype=np.float32)
+        sq_norms = np.empty(offsets[-1], dtype=np.float32)
+        for prn, first, last in zip(prns, offsets[:-1], offsets[1:]):
+            stored, block_scales = gallery.quantize(blocks[prn])
+            matrix[first:last] = stored
+            if block_scales is not None:
+                scales[first:last] = block_scales
+        gallery._matrix = matrix
+        gallery._scales = scales if storage == 'int8' else None
+        gallery.offsets = offsets
+        for start in range(0, len(matrix), cls.CHUNK_ROWS):
+            decoded = gallery.decode(start, start + cls.CHUNK_ROWS)
+            sq_norms[start:start + len(decoded)] = np.einsum('ij,ij->i', decoded, decoded)
+        gallery._sq_norms = sq_norms
+        gallery.prns = prns
+        gallery.rows = {prn: i for i, prn in enumerate(prns)}
+        gallery.max_samples = int(counts.max()) if prns else 0
+        return gallery
+
+    def use_index(self, index):
+        """Build an approximate index (e.g. IVFIndex) over the gallery and match through it; None restores exact search"""
+        with self.lock:
+            self.index = index.build(self.decode()) if index is not None else None
+
+    def train_index(self, index, path=None):
+        """Build ``index`` without holding the lock, then match through it.
+
+        Matching keeps using the exact scan while the index trains. If the gallery
+        changed in the meantime, the index is trained again on the new rows. With
+        ``path`` the trained index is also saved there (see IVFIndex.load).
+        """
+        while True:
+            with self.lock:
+                fingerprint, matrix = self.fingerprint(), self.decode()
+            index.build(matrix)
+            del matrix
+            with self.lock:
+                if self.fingerprint() == fingerprint:
+                    self.index = index
+                    if path is not None:
+                        index.save(path, fingerprint)
+                    return
+
+    def fingerprint(self):
+        """Digest of the students and stored rows, to tell whether a saved index still fits"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{self.mode}:{self.storage}:".encode('utf-8'))
+        digest.update('\x1f'.join(self.prns).encode('utf-8'))
+        digest.update(self.offsets.tobytes())
+        digest.update(np.ascontiguousarray(self.matrix))
+        if self._scales is not None:
+            digest.update(np.ascontiguousarray(self.scales))
+        return digest.digest()
+
+    def add(self, prn, encodings):
+        """Insert or replace all reference encodings of a PRN"""
+        block = self._prepare(encodings)
+        if not len(block):
+            raise ValueError("no encodings to add")
+        with self.lock:
+            student = self.rows.get(prn)
+            if student is None:
+                student = len(self.prns)
+                self.prns.append(prn)
+                self.rows[prn] = student
+                self.offsets = np.append(self.offsets, self.offsets[-1])
+            self._splice(student, block)
+            self.max_samples = max(self.max_samples, len(block))
+
+    def _splice(self, student, block):
+        """Replace a student's rows with ``block``, shifting the students stored after it"""
+        first, last = int(self.offsets[student]), int(self.offsets[student + 1])
+        total = self.samples
+        delta = len(block) - (last - first)
+        arrays = [name for name in ('_matrix', '_scales', '_sq_norms') if getattr(self, name) is not None]
+        if delta:
+            if self.index is not None:
+                for row in range(first, last):
+                    self.index.remove(row)
+                if last < total:
+                    self.index.shift(last, delta)
+            if total + delta > len(self._matrix):
+                self._grow(total + delta)
+            for name in arrays:
+                array = getattr(self, name)
+                array[last + delta:total + delta] = array[last:total]
+            self.offsets[student + 1:] += delta
+
+        end = first + len(block)
+        stored, scales = self.quantize(block)
+        self._matrix[first:end] = stored
+        if scales is not None:
+            self._scales[first:end] = scales
+        decoded = self.decode(first, end)
+        self._sq_norms[first:end] = np.einsum('ij,ij->i', decoded, decoded)
+        if self.index is not None:
+            for row, vector in zip(range(first, end), decoded):
+                self.index.add(row, vector)
+
+    def _grow(self, needed):
+        capacity = max(64, 2 * len(self._matrix), needed)
+        for name in ('_matrix', '_scales', '_sq_norms'):
+            array = getattr(self, name)
+            if array is not None:
+                grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+                grown[:self.samples] = array[:self.samples]
+                setattr(self, name, grown)
+
+    def distances(self, face_encodings):
+        """Euclidean distance from each query face to every student, shape (faces, students)"""
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, self.dim)
+        total = self.samples
+        if self.storage == 'float32':
+            dots = queries @ self.matrix.T
+        else:
+            # Dequantize a chunk at a time so matching never holds a float32 copy of the gallery
+            dots = np.empty((len(queries), total), dtype=np.float32)
+            for start in range(0, total, self.CHUNK_ROWS):
+                end = min(start + self.CHUNK_ROWS, total)
+                dots[:, start:end] = queries @ self._matrix[start:end].astype(np.float32).T
+            if self._scales is not None:
+                dots *= self.scales[None, :]
+        sq = np.einsum('ij,ij->i', queries, queries)[:, None] + self._sq_norms[None, :total] - 2.0 * dots
+        np.maximum(sq, 0.0, out=sq)
+        dists = np.sqrt(sq, out=sq)
+        if self.samples != len(self.prns):
+            # Closest sample per student, one reduction over the packed rows
+            dists = np.minimum.reduceat(dists, self.offsets[:-1], axis=1)
+        return dists
+
+    def nearest(self, face_encodings):
+        """Best student, its distance and the runner-up student's distance for each query face"""
+        if self.index is not None:
+            return self._nearest_indexed(np.asarray(face_encodings, dtype=np.float32).reshape(-1, self.dim))
+
+        dists = self.distances(face_encodings)
+        best = np.argmin(dists, axis=1)
+        best_dist = dists[np.arange(len(dists)), best]
+        if len(self.prns) > 1:
+            second_dist = np.partition(dists, 1, axis=1)[:, 1]
+        else:
+            second_dist = np.full(len(dists), np.inf, dtype=np.float32)
+        return best, best_dist, second_dist
+
+    def _nearest_indexed(self, queries):
+        # Enough neighbours that another student shows up even if the best one fills the front
+        rows, dists = self.index.search(self.matrix, self._sq_norms[:self.samples], queries,
+                                        k=self.max_samples + 1, scales=self.scales)
+        best = np.full(len(queries), -1, dtype=np.int64)
+        best_dist = np.full(len(queries), np.inf, dtype=np.float32)
+        second_dist = np.full(len(queries), np.inf, dtype=np.float32)
+        for q in range(len(queries)):
+            found = rows[q] >= 0
+            # Student owning each row, straight from the packed offsets
+            students = np.searchsorted(self.offsets, rows[q][found], side='right') - 1
+            found_dists = dists[q][found]
+            if not len(students):
+                continue
+            best[q], best_dist[q] = students[0], found_dists[0]
+            others = np.flatnonzero(students != students[0])
+            if len(others):
+                second_dist[q] = found_dists[others[0]]
+        return best, best_dist, second_dist
+
+    def match(self, face_encodings, tolerance=0.6):
+        """Return a FaceMatch per query face; prn is None when the best distance exceeds tolerance.
+
+        ``margin`` is the gap between the best and second best student's distance,
+        which tells how clearly the winner stands out from the rest of the roster.
+        """
+        if len(face_encodings) == 0:
+            return []
+        with self.lock:
+            if not self.prns:
+                return [FaceMatch(None, float('inf'), 0.0) for _ in range(len(face_encodings))]
+
+            best, best_dist, second_dist = self.nearest(face_encodings)
+            results = []
+            for student, dist, second in zip(best, best_dist, second_dist):
+                prn = self.prns[student] if student >= 0 and dist <= tolerance else None
+                results.append(FaceMatch(prn, float(dist), float(second - dist)))
+            return results
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')  # Photos and stills read for enrollment and batch mode
+
+
+def is_image_file(name):
+    """Whether a file name has one of IMAGE_EXTENSIONS, in any case (P1.JPG counts)"""
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def encode_image(image_path):
+    """Encoding of the first face found in an image file; raises if none is found"""
+    image = face_recognition.load_image_file(image_path)
+    encodings = face_recognition.face_encodings(image)
+    if not encodings:
+        raise ValueError("no face found in image")
+    return encodings[0]
+
+
+def _encode_chunk(jobs):
+    """Process-pool worker: encode (image_file, prn, image_path) jobs, never raising"""
+    results = []
+    for image_file, prn, image_path in jobs:
+        try:
+            results.append((image_file, prn, encode_image(image_path), None))
+        except Exception as e:
+            results.append((image_file, prn, None, str(e)))
+    return results
+
+
+def reference_images(path):
+    """(image_file, prn, image_path) for images/<PRN>.jpg and every photo in an images/<PRN>/ folder.
+
+    image_file is the path relative to the images folder and keys the encoding cache.
+    """
+    images = []
+    for entry in sorted(os.listdir(path)):
+        entry_path = os.path.join(path, entry)
+        if os.path.isdir(entry_path):
+            for image_file in sorted(os.listdir(entry_path)):
+                if is_image_file(image_file):
+                    images.append((f"{entry}/{image_file}", entry, os.path.join(entry_path, image_file)))
+        elif is_image_file(entry):
+            images.append((entry, entry.split('.')[0], entry_path))
+    return images
+
+
+def load_reference_encodings(path, cache, on_progress=None, max_workers=None):
+    """({prn: {image_file: encoding}}, [(prn, error)]) for every reference photo.
+
+    Cached encodings are reused; cache misses are encoded in a spawned process pool
+    in chunks of a few images and stored in ``cache``, except that a single miss is
+    encoded in this process. ``on_progress(done, total, failed)`` is called as
+    chunks finish and while waiting for them, so a GUI can keep drawing. Images
+    that fail to encode are reported on the console and left out; the failure is
+    cached, so they are only tried again once the file changes.
+    """
+    encodings = {}
+    errors = []
+    jobs = []
+    for image_file, prn, image_path in reference_images(path):
+        encoding = cache.get(image_file, image_path)
+        if encoding is not None:
+            encodings.setdefault(prn, {})[image_file] = encoding
+            continue
+        error = cache.error(image_file, image_path)
+        if error is None:
+            jobs.append((image_file, prn, image_path))
+        else:
+            print(f"Skipping {image_file} for PRN {prn}, unchanged since it failed: {error}")
+    done = 0
+
+    def collect(results):
+        nonlocal done
+        for image_file, prn, encoding, error in results:
+            if error is None:
+                encodings.setdefault(prn, {})[image_file] = encoding
+                cache.put(image_file, os.path.join(path, image_file), prn, encoding)
+            else:
+                errors.append((prn, error))
+                print(f"Error encoding face for PRN {prn}: {error}")
+                try:
+                    cache.put_error(image_file, os.path.join(path, image_file), prn, error)
+                except OSError:
+                    pass  # Unreadable or gone: simply tried again next time
+            done += 1
+        if on_progress:
+            on_progress(done, len(jobs), len(errors))
+
+    if len(jobs) == 1:
+        if on_progress:
+            on_progress(0, 1, 0)
+        collect(_encode_chunk(jobs))
+    elif jobs:
+        workers = min(max_workers or os.cpu_count() or 1, len(jobs))
+        # Small chunks so progress moves per handful of images, not per worker share
+        chunk_size = max(1, min(4, len(jobs) // (workers * 4)))
+        chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+        # Spawned, not forked: the caller may already be running other threads
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            pending = {executor.submit(_encode_chunk, chunk) for chunk in chunks}
+            while pending:
+                finished, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    collect(future.result())
+                if not finished and on_progress:
+                    on_progress(done, len(jobs), len(errors))
+    return encodings, errors
+
+
+class EncodingCache:
+    """On-disk cache of face encodings keyed by image file name.
+
+    Encodings live in a single ``encodings.npy`` matrix that is memory-mapped on load,
+    with ``index.json`` holding each image's PRN, size, mtime, content hash and row.
+    An image is only re-encoded when its size or mtime changed *and* its content
+    hash no longer matches, so a warm start costs a stat per image. Images that
+    failed to encode (no face found) are indexed too, with their error and no row,
+    so an unchanged bad photo is not retried on every start. ``files`` maps each PRN
+    to its image files, for looking up one student's photos.
+    """
+
+    MATRIX_FILE = 'encodings.npy'
+    INDEX_FILE = 'index.json'
+    COMPACT_FRACTION = 0.25  # Rewrite the matrix once this share of its rows belongs to no image
+
+    def __init__(self, cache_dir, dim=128):
+        self.cache_dir = cache_dir
+        self.dim = dim
+        self.index = {}
+        self.files = {}
+        self.matrix = np.empty((0, dim), dtype=np.float32)
+        self.pending = {}
+        self.seen = set()
+        self.dirty = False
+
+    def load(self):
+        """Load the index and memory-map the encoding matrix; a broken cache is treated as empty"""
+        matrix_path = os.path.join(self.cache_dir, self.MATRIX_FILE)
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        try:
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            matrix = np.load(matrix_path, mmap_mode='r')
+            if matrix.ndim != 2 or matrix.shape[1] != self.dim:
+                raise ValueError("encoding dimension mismatch")
+            if any(entry.get('row', -1) >= len(matrix) for entry in index.values()):
+                raise ValueError("index refers to missing rows")
+            self.index, self.matrix = index, matrix
+        except (OSError, ValueError, KeyError) as e:
+            if os.path.exists(index_path):
+                print(f"Ignoring unreadable encoding cache: {str(e)}")
+            self.index = {}
+            self.matrix = np.empty((0, self.dim), dtype=np.float32)
+        self.files = {}
+        for image_file, entry in self.index.items():
+            self.files.setdefault(entry['prn'], set()).add(image_file)
+        return self
+
+    @staticmethod
+    def file_hash(image_path):
+        digest = hashlib.sha1()
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _current(self, image_file, image_path):
+        """Index entry for an image that has not changed since it was recorded, else None"""
+        self.seen.add(image_file)
+        entry = self.index.get(image_file)
+        if entry is None:
+            return None
+        stat = os.stat(image_path)
+        if entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            if entry['sha1'] != self.file_hash(image_path):
+                return None
+            # Touched but unchanged (copied, re-synced): keep the entry, refresh the stat
+            entry['size'], entry['mtime_ns'] = stat.st_size, stat.st_mtime_ns
+            self.dirty = True
+        return entry
+
+    def known(self, image_file, image_path):
+        """Whether an image is cached, encoded or failed, and has not changed since"""
+        return self._current(image_file, image_path) is not None
+
+    def get(self, image_file, image_path):
+        """Return the cached encoding for an image, or None if it must be re-encoded or failed before"""
+        entry = self._current(image_file, image_path)
+        if entry is None or 'row' not in entry:
+            return None
+        return np.array(self.matrix[entry['row']])
+
+    def error(self, image_file, image_path):
+        """Error recorded for an unchanged image that failed to encode, or None"""
+        entry = self._current(image_file, image_path)
+        return entry.get('error') if entry is not None else None
+
+    def encodings_for(self, prn):
+        """{image_file: encoding} of every cached photo of a PRN, including ones not saved yet"""
+        found = {}
+        for image_file in sorted(self.files.get(prn, ())):
+            entry = self.pending.get(image_file) or self.index[image_file]
+            if 'encoding' in entry:
+                found[image_file] = entry['encoding']
+            elif 'row' in entry:
+                found[image_file] = np.array(self.matrix[entry['row']])
+        return found
+
+    def _record(self, image_file, image_path, prn, **result):
+        stat = os.stat(image_path)
+        self.seen.add(image_file)
+        self.pending[image_file] = dict(prn=prn, size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                                        sha1=self.file_hash(image_path), **result)
+        self.files.setdefault(prn, set()).add(image_file)
+        self.dirty = True
+
+    def put(self, image_file, image_path, prn, encoding):
+        """Record a freshly computed encoding; written out by save()"""
+        self._record(image_file, image_path, prn, encoding=np.asarray(encoding, dtype=np.float32))
+
+    def put_error(self, image_file, image_path, prn, error):
+        """Record that an image failed to encode, so it is skipped until it changes"""
+        self._record(image_file, image_path, prn, error=error)
+
+    def save(self):
+        """Write out what changed, dropping images that no longer exist.
+
+        New encodings are appended to ``encodings.npy`` in place and only
+        ``index.json`` is rewritten. Rows of replaced or deleted images stay in the
+        matrix until they exceed COMPACT_FRACTION of it; then it is rewritten
+        without them.
+        """
+        stale = set(self.index) - self.seen
+        if not self.dirty and not stale:
+            return
+
+        index = {name: entry for name, entry in self.index.items() if name in self.seen}
+        fresh = {name: dict(entry) for name, entry in self.pending.items()}
+        index.update(fresh)
+        new = [name for name, entry in fresh.items() if 'encoding' in entry]
+        rows = np.empty((len(new), self.dim), dtype=np.float32)
+        for row, name in enumerate(new):
+            rows[row] = fresh[name].pop('encoding')
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        matrix_path = os.path.join(self.cache_dir, self.MATRIX_FILE)
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        count = len(self.matrix)
+        unused = count - sum(1 for entry in index.values() if 'row' in entry)
+        if count and unused <= self.COMPACT_FRACTION * (count + len(new)) and self._append(matrix_path, count, rows):
+            for row, name in enumerate(new, count):
+                fresh[name]['row'] = row
+        else:
+            kept = [name for name, entry in index.items() if 'row' in entry]
+            matrix = np.empty((len(kept) + len(new), self.dim), dtype=np.float32)
+            matrix[:len(kept)] = self.matrix[np.array([index[name]['row'] for name in kept], dtype=np.intp)]
+            matrix[len(kept):] = rows
+            for row, name in enumerate(kept):
+                index[name] = dict(index[name], row=row)
+            for row, name in enumerate(new, len(kept)):
+                fresh[name]['row'] = row
+            # Release the memory map before replacing the file underneath it
+            self.matrix = matrix
+            with open(matrix_path + '.tmp', 'wb') as f:
+                np.save(f, matrix)
+            os.replace(matrix_path + '.tmp', matrix_path)
+        # Rows appended before the index is replaced are simply unused if we stop in between
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(index_path + '.tmp', index_path)
+
+        # Back to a memory map, so the cache holds no copy of the encodings in RAM
+        self.matrix = np.load(matrix_path, mmap_mode='r')
+        for name in stale:
+            self.files[self.index[name]['prn']].discard(name)
+        self.index = index
+        self.pending = {}
+        self.dirty = False
+
+    def _append(self, matrix_path, count, rows):
+        """Append rows to the .npy file in place; False when its header is not for ``count`` rows or cannot grow"""
+        fmt = np.lib.format
+        with open(matrix_path, 'r+b') as f:
+            version = fmt.read_magic(f)
+            if version == (1, 0):
+                read_header, write_header = fmt.read_array_header_1_0, fmt.write_array_header_1_0
+            elif version == (2, 0):
+                read_header, write_header = fmt.read_array_header_2_0, fmt.write_array_header_2_0
+            else:
+                return False
+            shape, fortran_order, dtype = read_header(f)
+            if shape != (count, self.dim) or fortran_order or dtype != np.float32:
+                return False
+            data_start = f.tell()
+            # np.save pads the header so the row count can grow without moving the data
+            header = io.BytesIO()
+            write_header(header, {'descr': fmt.dtype_to_descr(dtype), 'fortran_order': False,
+                                  'shape': (count + len(rows), self.dim)})
+            if header.tell() != data_start:
+                return False
+            f.seek(data_start + count * rows.strides[0])
+            f.write(rows.tobytes())
+            f.flush()
+            f.seek(0)
+            f.write(header.getvalue())
+        return True
+
+
+class FrameRing:
+    """Small ring of preallocated frame buffers where the newest frame always wins.
+
+    The capture thread copies each frame into the next slot; readers copy the newest
+    slot out under the lock, so a slow reader never blocks capture and never sees a
+    half-written frame.
+    """
+
+    def __init__(self, slots=3):
+        self.slots = slots
+        self.buffers = None
+        self.timestamps = [0.0] * slots
+        self.seq = -1
+        self.lock = threading.Condition()
+
+    def write(self, frame):
+        with self.lock:
+            if self.buffers is None or self.buffers[0].shape != frame.shape:
+                self.buffers = [np.empty_like(frame) for _ in range(self.slots)]
+            slot = (self.seq + 1) % self.slots
+            np.copyto(self.buffers[slot], frame)
+            self.timestamps[slot] = time.monotonic()
+            self.seq += 1
+            self.lock.notify_all()
+            return self.seq
+
+    def latest(self, after_seq=-1, out=None, timeout=0):
+        """Return (seq, timestamp, frame) for the newest frame, or None if nothing newer than after_seq.
+
+        With a timeout, waits up to that many seconds for a newer frame to arrive.
+        """
+        with self.lock:
+            if timeout and self.seq <= after_seq:
+                self.lock.wait_for(lambda: self.seq > after_seq, timeout)
+            if self.seq <= after_seq or self.buffers is None:
+                return None
+            slot = self.seq % self.slots
+            if out is None or out.shape != self.buffers[slot].shape:
+                out = self.buffers[slot].copy()
+            else:
+                np.copyto(out, self.buffers[slot])
+            return self.seq, self.timestamps[slot], out
+
+
+class CameraCapture:
+    """Reads frames from a cv2.VideoCapture on its own thread into a FrameRing.
+
+    ``stats`` exposes frames captured, frames dropped (overwritten before the
+    recognizer consumed them), failed reads and the average blocking time of
+    ``cap.read()`` in milliseconds. With ``fps`` set, reads are paced to that rate,
+    so a video file plays back like a live camera instead of as fast as it decodes.
+    """
+
+    def __init__(self, cap, slots=3, fps=None):
+        self.cap = cap
+        self.interval = 1.0 / fps if fps else 0.0
+        self.ring = FrameRing(slots)
+        self.stats = {'captured': 0, 'dropped': 0, 'failed_reads': 0, 'latency_ms': 0.0}
+        self.last_consumed = -1
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='camera-capture', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=1.0)
+        self.cap.release()
+
+    def _run(self):
+        next_read = time.perf_counter()
+        while not self._stop.is_set():
+            if self.interval:
+                next_read += self.interval
+                delay = next_read - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            start = time.perf_counter()
+            ret, frame = self.cap.read()
+            latency_ms = (time.perf_counter() - start) * 1000
+            if not ret:
+                self.stats['failed_reads'] += 1
+                time.sleep(0.01)
+                continue
+            self.ring.write(frame)
+            self.stats['captured'] += 1
+            self.stats['latency_ms'] += 0.1 * (latency_ms - self.stats['latency_ms'])
+
+    def peek(self, after_seq=-1):
+        """Newest frame for display; does not count as consumed"""
+        return self.ring.latest(after_seq)
+
+    def consume(self, out=None, timeout=0):
+        """Newest unprocessed frame for the recognizer, counting any frames it skipped"""
+        latest = self.ring.latest(self.last_consumed, out, timeout)
+        if latest is not None:
+            self.stats['dropped'] += latest[0] - self.last_consumed - 1
+            self.last_consumed = latest[0]
+        return latest
+
+
+class FlowTracker:
+    """Box tracker following corner features with pyramidal Lucas-Kanade optical flow.
+
+    Has the init()/update() interface of the OpenCV trackers. The box moves by the
+    median shift of the features that also flow back to where they started, and
+    the face counts as lost once fewer than ``min_points`` of them survive. The
+    box keeps its size; the next detection corrects it.
+    """
+
+    def __init__(self, max_corners=30, min_points=5, max_error=1.0):
+        self.max_corners = max_corners
+        self.min_points = min_points
+        self.max_error = max_error
+        self.gray = None
+        self.points = None
+        self.rect = None
+
+    def init(self, frame, rect):
+        x, y, w, h = (int(v) for v in rect)
+        self.gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        mask = np.zeros_like(self.gray)
+        mask[max(0, y):y + h, max(0, x):x + w] = 255
+        self.points = cv2.goodFeaturesToTrack(self.gray, self.max_corners, 0.01, 3, mask=mask)
+        self.rect = (float(x), float(y), w, h)
+
+    def update(self, frame):
+        if self.points is None or len(self.points) < self.min_points:
+            return False, self.rect
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        forward, status, _ = cv2.calcOpticalFlowPyrLK(self.gray, gray, self.points, None)
+        backward, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self.gray, forward, None)
+        error = np.linalg.norm((backward - self.points).reshape(-1, 2), axis=1)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < self.max_error)
+        if np.count_nonzero(good) < self.min_points:
+            return False, self.rect
+        dx, dy = np.median((forward - self.points).reshape(-1, 2)[good], axis=0)
+        x, y, w, h = self.rect
+        self.rect = (x + float(dx), y + float(dy), w, h)
+        self.gray = gray
+        self.points = forward[good].reshape(-1, 1, 2)
+        return True, self.rect
+
+
+def create_face_tracker():
+    """Cheapest tracker in this build: MOSSE or KCF from OpenCV, else FlowTracker.
+
+    MIL, the only tracker left in OpenCV 5 without contrib, costs more per update
+    than the HOG detection that tracking is there to skip.
+    """
+    for owner, name in ((getattr(cv2, 'legacy', None), 'TrackerMOSSE_create'),
+                        (cv2, 'TrackerKCF_create')):
+        factory = getattr(owner, name, None)
+        if factory is not None:
+            return factory()
+    return FlowTracker()
+
+
+def box_iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return inter / float(area_a + area_b - inter) if inter else 0.0
+
+
+class FaceTrack:
+    """A face followed across frames by a box tracker between detections"""
+
+    def __init__(self, track_id, box, frame):
+        self.id = track_id
+        self.prn = None
+        self.reported = None
+        self.votes = []
+        self.verified_at = None
+        self.pending = False  # An encoding is running in the recognition pool
+        self.reset(box, frame)
+
+    def vote(self, frame_count, prn, needed, window):
+        """Record a match; returns the PRN once ``needed`` votes agree within ``window`` frames"""
+        self.votes = [(at, voted) for at, voted in self.votes if frame_count - at < window]
+        self.votes.append((frame_count, prn))
+        if prn is not None and sum(1 for _, voted in self.votes if voted == prn) >= needed:
+            self.prn = prn
+            return prn
+        return None
+
+    def forget(self):
+        """Drop the identity, e.g. when the face was lost and someone else may stand in its place"""
+        self.prn = None
+        self.reported = None
+        self.votes = []
+        self.verified_at = None
+
+    def reset(self, box, frame):
+        self.box = box
+        top, right, bottom, left = box
+        self.tracker = create_face_tracker()
+        self.tracker.init(frame, (left, top, right - left, bottom - top))
+
+    def update(self, frame):
+        ok, (x, y, w, h) = self.tracker.update(frame)
+        if ok:
+            self.box = (int(y), int(x + w), int(y + h), int(x))
+        return ok
+
+
+class MotionGate:
+    """Cheap scene-change test on a tiny grayscale thumbnail.
+
+    Each frame is shrunk to ``size`` and compared with a slowly updated background;
+    the scene counts as moving when more than ``min_changed`` of the thumbnail's
+    pixels differ by more than ``threshold`` grey levels. Lower either value to
+    make the gate more sensitive.
+    """
+
+    def __init__(self, size=(32, 24), threshold=12, min_changed=0.02, learning_rate=0.05):
+        self.size = size
+        self.threshold = threshold
+        self.min_changed = min_changed
+        self.learning_rate = learning_rate
+        self.background = None
+
+    def moving(self, frame):
+        thumb = cv2.cvtColor(cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        thumb = thumb.astype(np.float32)
+        if self.background is None:
+            self.background = thumb
+            return True
+        changed = np.count_nonzero(np.abs(thumb - self.background) > self.threshold) / thumb.size
+        self.background += self.learning_rate * (thumb - self.background)
+        return changed >= self.min_changed
+
+
+def _locate_faces(small_frame):
+    """Process-pool worker: HOG face boxes in an RGB frame"""
+    return face_recognition.face_locations(small_frame)
+
+
+def _encode_faces(small_frame, boxes):
+    """Process-pool worker: encodings of the given face boxes in an RGB frame"""
+    return face_recognition.face_encodings(small_frame, boxes)
+
+
+class MarkDeduplicator:
+    """Remembers successful marks for ``window`` seconds so repeat sightings are dropped quietly.
+
+    Keys are (prn, lecture column): the same student seen again by another camera
+    during the same lecture is ignored, while the next lecture is marked as usual.
+    Only marks that were actually recorded are remembered, so a failed mark can be
+    retried on the next sighting.
+    """
+
+    def __init__(self, window=600.0):
+        self.window = window
+        self.seen = {}
+
+    def recent(self, key):
+        last = self.seen.get(key)
+        return last is not None and time.monotonic() - last < self.window
+
+    def record(self, key):
+        now = time.monotonic()
+        self.seen = {seen: at for seen, at in self.seen.items() if now - at < self.window}
+        self.seen[key] = now
+
+
+class RecognitionWorker:
+    """Runs face detection, tracking, encoding and gallery matching off the GUI thread.
+
+    The worker pulls the newest frame from a CameraCapture at its own pace and posts
+    a RecognitionResult (or an ('error', message) tuple) to ``results``, which the
+    GUI drains once per tick.
+
+    HOG detection runs only every ``detect_every`` frames or when a tracker loses its
+    face; in between, faces are followed by cheap trackers (see create_face_tracker).
+    An unconfirmed track is encoded every ``vote_every`` frames and votes for its
+    best match; once ``votes_needed`` votes agree within ``vote_window`` frames its
+    identity is confirmed and reported once in ``matches``. A confirmed track is
+    only re-encoded every ``recheck_every`` frames; if the face no longer matches
+    its identity, voting starts over and a different confirmed identity is
+    reported, while the same one is not reported again. A track whose tracker lost
+    its face gives up its identity when a detection picks it up again.
+    While nothing is being tracked, frames the ``motion_gate`` finds static are
+    skipped before any detection and counted in ``stats['skipped']``.
+
+    With an ``executor`` the HOG detection and the encoding of each track are
+    submitted to that process pool as separate tasks instead of running on this
+    thread, which goes on tracking the next frames meanwhile. Up to
+    ``max_in_flight`` tasks per feed are outstanding; their results are applied in
+    the order they were submitted, a detection's boxes being carried forward to the
+    newest frame by the trackers. ``results`` may be shared with workers for other
+    cameras (see RecognitionPool).
+    """
+
+    def __init__(self, capture, gallery, tolerance=0.6, scale=0.25, detect_every=10,
+                 vote_every=2, votes_needed=3, vote_window=15, recheck_every=60, motion_gate=None,
+                 executor=None, max_in_flight=4, results=None, source=0):
+        self.capture = capture
+        self.executor = executor
+        self.max_in_flight = max_in_flight
+        self.in_flight = deque()
+        self.source = source
+        self.motion_gate = motion_gate
+        self.gallery = gallery
+        self.tolerance = tolerance
+        self.scale = scale
+        self.detect_every = detect_every
+        self.vote_every = vote_every
+        self.votes_needed = votes_needed
+        self.vote_window = vote_window
+        self.recheck_every = recheck_every
+        self.tracks = []
+        self.next_track_id = 0
+        self.frame_count = 0
+        self.last_detection = None
+        self.results = results if results is not None else queue.Queue()
+        self.stats = {'processed': 0, 'skipped': 0, 'detections': 0, 'encodings': 0, 'latency_ms': 0.0}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'face-recognition-{source}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=2.0)
+
+    def _run(self):
+        frame = None
+        while not self._stop.is_set():
+            latest = self.capture.consume(out=frame, timeout=0.1)
+            if latest is None:
+                continue
+            seq, _, frame = latest
+            try:
+                result = self.recognize(seq, frame)
+                if result is not None:
+                    self.results.put(result)
+            except Exception as e:
+                self.results.put(('error', str(e)))
+                return
+
+    def detect(self, small_frame, lost=()):
+        """Run HOG detection on this frame; with an executor it is only submitted here"""
+        self.stats['detections'] += 1
+        self.last_detection = self.frame_count
+        if self.executor is None:
+            self.reconcile(face_recognition.face_locations(small_frame), small_frame, lost)
+        else:
+            self.in_flight.append(('detect', self.executor.submit(_locate_faces, small_frame), (small_frame, lost)))
+
+    def reconcile(self, boxes, small_frame, lost=(), current=None):
+        """Reconcile boxes detected in ``small_frame`` with the current tracks by IoU.
+
+        ``current`` is the newer frame the tracks have moved on to while a pipelined
+        detection was running; the matched and new trackers catch up to it.
+        """
+        tracks = []
+        unmatched = list(self.tracks)
+        for box in boxes:
+            best = max(unmatched, key=lambda track: box_iou(track.box, box), default=None)
+            if best is not None and box_iou(best.box, box) >= 0.3:
+                unmatched.remove(best)
+                if best in lost:
+                    best.forget()
+                best.reset(box, small_frame)
+                track = best
+            else:
+                track = FaceTrack(self.next_track_id, box, small_frame)
+                self.next_track_id += 1
+            if current is not None:
+                track.update(current)
+            tracks.append(track)
+        self.tracks = tracks
+
+    def needs_encoding(self, track):
+        if track.pending:
+            return False
+        if track.verified_at is None:
+            return True
+        # Confirmed faces are only re-checked now and then
+        every = self.recheck_every if track.prn is not None else self.vote_every
+        return self.frame_count - track.verified_at >= every
+
+    def vote(self, tracks, face_encodings, frame_count, matches, track_ids):
+        """Match the encodings of ``tracks`` taken at ``frame_count`` and collect newly confirmed identities"""
+        for track, match in zip(tracks, self.gallery.match(face_encodings, tolerance=self.tolerance)):
+            track.verified_at = frame_count
+            if track.prn is not None:
+                if match.prn == track.prn:
+                    continue
+                track.prn, track.votes = None, []  # Someone else now: vote again
+            if track.vote(frame_count, match.prn, self.votes_needed, self.vote_window):
+                if track.reported != match.prn:
+                    track.reported = match.prn
+                    matches.append(match)
+                    track_ids.append(track.id)
+
+    def apply_next(self, small_frame, matches, track_ids):
+        """Wait for the oldest pipelined task and apply its result, so results land in submission order"""
+        kind, future, payload = self.in_flight.popleft()
+        result = future.result()
+        if kind == 'detect':
+            frame, lost = payload
+            self.reconcile(result, frame, lost, current=small_frame)
+        else:
+            track, frame_count = payload
+            track.pending = False
+            if track in self.tracks:  # Not dropped by a detection in the meantime
+                self.vote([track], result, frame_count, matches, track_ids)
+
+    def recognize(self, seq, frame):
+        """Process one frame; returns None when the motion gate skipped it"""
+        if not self.tracks and not self.in_flight and self.motion_gate is not None \
+                and not self.motion_gate.moving(frame):
+            self.stats['skipped'] += 1
+            return None
+
+        start = time.perf_counter()
+        self.frame_count += 1
+
+        # Resize frame for faster face recognition, then convert it from BGR to RGB
+        small_frame = cv2.cvtColor(cv2.resize(frame, (0, 0), fx=self.scale, fy=self.scale), cv2.COLOR_BGR2RGB)
+
+        # Follow known faces with their trackers, then take in any pipelined results that are ready
+        lost = [track for track in self.tracks if not track.update(small_frame)]
+        matches = []
+        track_ids = []
+        while self.in_flight and self.in_flight[0][1].done():
+            self.apply_next(small_frame, matches, track_ids)
+
+        # Detect afresh on schedule or when a face is lost
+        if lost or not self.tracks or self.frame_count - self.last_detection >= self.detect_every:
+            self.detect(small_frame, lost)
+
+        # Encode tracks that are due, match them and report newly confirmed identities
+        to_encode = [track for track in self.tracks if self.needs_encoding(track)]
+        if to_encode:
+            if self.executor is None:
+                face_encodings = face_recognition.face_encodings(small_frame, [track.box for track in to_encode])
+                self.vote(to_encode, face_encodings, self.frame_count, matches, track_ids)
+            else:
+                # One task per track, so a single feed keeps several pool processes busy
+                for track in to_encode:
+                    track.pending = True
+                    future = self.executor.submit(_encode_faces, small_frame, [track.box])
+                    self.in_flight.append(('encode', future, (track, self.frame_count)))
+            self.stats['encodings'] += len(to_encode)
+
+        # Only block once this feed has as many tasks queued as it may
+        while len(self.in_flight) > self.max_in_flight:
+            self.apply_next(small_frame, matches, track_ids)
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.stats['processed'] += 1
+        self.stats['latency_ms'] += 0.1 * (elapsed_ms - self.stats['latency_ms'])
+        return RecognitionResult(seq, [track.box for track in self.tracks], matches, track_ids, elapsed_ms,
+                                 self.source)
+
+
+def camera_sources(spec):
+    """Parse a comma-separated list of camera sources: device indices, video files or stream URLs"""
+    return [int(part) if part.isdigit() else part for part in (part.strip() for part in spec.split(',')) if part]
+
+
+class RecognitionPool:
+    """Several cameras sharing one pool of recognition processes and one mark stream.
+
+    Every source keeps its own CameraCapture thread and a light RecognitionWorker
+    thread that tracks the faces in that feed in order; the expensive HOG detection
+    and encoding calls of all feeds run in one shared pool of ``workers`` processes.
+    Each feed keeps several of those tasks in flight, so throughput grows with the
+    worker count even when there are fewer cameras than workers. All results land on the shared ``results`` queue; a student confirmed at
+    several doors is reported once per camera, and the GUI drops the repeats.
+
+    A single camera with no ``workers`` count given gets no process pool: its
+    RecognitionWorker detects and encodes on its own thread, as before.
+    """
+
+    def __init__(self, captures, gallery, workers=None, motion_gate=True, **options):
+        self.captures = captures
+        self.workers = workers or min(len(captures), os.cpu_count() or 1)
+        if workers is None and len(captures) == 1:
+            self.executor = None  # Nothing to share; spawning processes would only add start-up time and IPC
+        else:
+            # Spawned, not forked: the GUI, capture and sheet threads are already running
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        self.results = queue.Queue()
+        # Enough tasks per feed to keep every worker busy, plus one queued behind them
+        options.setdefault('max_in_flight', -(-self.workers // len(captures)) + 1)
+        self.recognizers = [
+            RecognitionWorker(capture, gallery, motion_gate=MotionGate() if motion_gate else None,
+                              executor=self.executor, results=self.results, source=source,
+                              **options)
+            for source, capture in enumerate(captures)
+        ]
+
+    @classmethod
+    def open(cls, sources, gallery, **kwargs):
+        """Open every source (device index, video file or stream URL) and start capturing from it"""
+        captures = []
+        try:
+            for source in sources:
+                cap = cv2.VideoCapture(source)
+                if not cap.isOpened():
+                    cap.release()
+                    raise ValueError(f"Could not open camera {source}")
+                # Recorded files play back at their own frame rate, like a live feed
+                fps = (cap.get(cv2.CAP_PROP_FPS) or 30.0) if isinstance(source, str) and os.path.isfile(source) else None
+                captures.append(CameraCapture(cap, fps=fps).start())
+        except Exception:
+            for capture in captures:
+                capture.stop()
+            raise
+        return cls(captures, gallery, **kwargs)
+
+    @property
+    def stats(self):
+        """Recognition counters summed over all sources, with their mean latency"""
+        totals = {key: sum(recognizer.stats[key] for recognizer in self.recognizers)
+                  for key in ('processed', 'skipped', 'detections', 'encodings')}
+        totals['latency_ms'] = sum(r.stats['latency_ms'] for r in self.recognizers) / len(self.recognizers)
+        return totals
+
+    def start(self):
+        for recognizer in self.recognizers:
+            recognizer.start()
+        return self
+
+    def stop(self):
+        for recognizer in self.recognizers:
+            recognizer.stop()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        for capture in self.captures:
+            capture.stop()
+
+
+_batch_worker = None
+
+
+def _init_batch_worker(encodings, mode, storage, tolerance, scale):
+    """Process-pool initializer: give each batch worker its own copy of the gallery"""
+    global _batch_worker
+    _batch_worker = (FaceGallery.from_encodings(encodings, mode=mode, storage=storage), tolerance, scale)
+
+
+def _recognize_batch_frame(item):
+    """Process-pool worker: detect, encode and match the faces of one sampled frame, never raising.
+
+    ``frame`` is either an already downscaled BGR frame or the path of a still to load.
+    Returns (index, timestamp, faces found, recognised FaceMatches, error).
+    """
+    index, timestamp, frame = item
+    gallery, tolerance, scale = _batch_worker
+    try:
+        if isinstance(frame, str):
+            image = cv2.imread(frame)
+            if image is None:
+                raise ValueError(f"could not read {frame}")
+            frame = cv2.resize(image, (0, 0), fx=scale, fy=scale)
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        locations = face_recognition.face_locations(rgb_frame)
+        matches = []
+        if locations:
+            face_encodings = face_recognition.face_encodings(rgb_frame, locations)
+            matches = [match for match in gallery.match(face_encodings, tolerance=tolerance) if match.prn is not None]
+        return index, timestamp, len(locations), matches, None
+    except Exception as e:
+        return index, timestamp, 0, [], str(e)
+
+
+class BatchAttendance:
+    """Headless face recognition over a recorded video file or a folder of stills.
+
+    Every ``every``-th video frame is decoded and downscaled here and streamed to a
+    pool of worker processes, each holding its own gallery, with at most two frames
+    per worker in flight so memory stays flat however long the recording is.
+    Sampled frames are too far apart to track faces between them, so a student
+    counts as present once matched in ``min_frames`` of them.
+    """
+
+    def __init__(self, encodings, workers=None, every=5, scale=0.25, tolerance=0.6, min_frames=2,
+                 mode='nearest', storage='int8'):
+        self.encodings = encodings
+        self.workers = workers or os.cpu_count() or 1
+        self.every = max(1, every)
+        self.scale = scale
+        self.tolerance = tolerance
+        self.min_frames = min_frames
+        self.mode = mode
+        self.storage = storage
+        self.stats = {'read': 0, 'processed': 0, 'faces': 0, 'matches': 0, 'errors': 0, 'elapsed_s': 0.0}
+
+    def frames(self, source):
+        """Yield (index, seconds into the recording or None, frame or image path) samples"""
+        if os.path.isdir(source):
+            names = sorted(name for name in os.listdir(source) if is_image_file(name))
+            for index, name in enumerate(names):
+                self.stats['read'] += 1
+                yield index, None, os.path.join(source, name)
+            return
+
+        cap = cv2.VideoCapture(source)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video {source}")
+        try:
+            index = 0
+            while True:
+                if index % self.every:
+                    # Skipped frames are only grabbed, never converted or shipped to a worker
+                    if not cap.grab():
+                        break
+                else:
+                    ok, frame = cap.read()
+                    if not ok:
+                        break
+                    timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                    yield index, timestamp, cv2.resize(frame, (0, 0), fx=self.scale, fy=self.scale)
+                self.stats['read'] += 1
+                index += 1
+        finally:
+            cap.release()
+
+    def run(self, source):
+        """Process a source; returns {prn: {'frames', 'first_frame', 'first_seen', 'distance'}} for present students"""
+        sightings = {}
+
+        def collect(result):
+            index, timestamp, faces, matches, error = result
+            self.stats['processed'] += 1
+            self.stats['faces'] += faces
+            if error is not None:
+                self.stats['errors'] += 1
+                print(f"Frame {index}: {error}")
+            for match in matches:
+                self.stats['matches'] += 1
+                seen = sightings.setdefault(match.prn, {'frames': 0, 'first_frame': index,
+                                                        'first_seen': timestamp, 'distance': match.distance})
+                seen['frames'] += 1
+                if index < seen['first_frame']:
+                    seen['first_frame'], seen['first_seen'] = index, timestamp
+                seen['distance'] = min(seen['distance'], match.distance)
+
+        start = time.perf_counter()
+        initargs = (self.encodings, self.mode, self.storage, self.tolerance, self.scale)
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_batch_worker,
+                                 initargs=initargs) as executor:
+            in_flight = set()
+            for item in self.frames(source):
+                if len(in_flight) >= 2 * self.workers:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future.result())
+                in_flight.add(executor.submit(_recognize_batch_frame, item))
+            for future in as_completed(in_flight):
+                collect(future.result())
+        self.stats['elapsed_s'] = time.perf_counter() - start
+        return {prn: seen for prn, seen in sightings.items() if seen['frames'] >= self.min_frames}
+
+
+class LocalSheet:
+    """CSV-backed stand-in for the gspread worksheet calls this app makes.
+
+    Lets the app run and be exercised offline: point ATTENDIFY_LOCAL_SHEET at a CSV
+    such as '2Attendance Sheet - Sheet1.csv' and every read and write goes to that file.
+    """
+
+    def __init__(self, csv_path):
+        self.csv_path = csv_path
+        self.lock = threading.Lock()
+        self.mtime_ns = None
+        self.rows = []
+        self._sync()
+
+    def _sync(self):
+        """Reload the CSV if something else (an editor, another kiosk) changed it"""
+        mtime_ns = os.stat(self.csv_path).st_mtime_ns
+        if mtime_ns != self.mtime_ns:
+            with open(self.csv_path, newline='') as f:
+                self.rows = [row for row in csv.reader(f)]
+            self.mtime_ns = mtime_ns
+
+    def _save(self):
+        tmp_path = self.csv_path + '.tmp'
+        with open(tmp_path, 'w', newline='') as f:
+            csv.writer(f).writerows(self.rows)
+        os.replace(tmp_path, self.csv_path)
+        self.mtime_ns = os.stat(self.csv_path).st_mtime_ns
+
+    def _set(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row - 1]
+        while len(cells) < col:
+            cells.append('')
+        cells[col - 1] = str(value)
+
+    def revision(self):
+        """Cheap change marker, the local analogue of the Drive modifiedTime"""
+        return os.stat(self.csv_path).st_mtime_ns
+
+    def get_all_values(self):
+        with self.lock:
+            self._sync()
+            return [list(row) for row in self.rows]
+
+    def get_all_records(self):
+        with self.lock:
+            self._sync()
+            header = self.rows[0] if self.rows else []
+            return [dict(zip(header, row + [''] * (len(header) - len(row)))) for row in self.rows[1:]]
+
+    def row_values(self, row):
+        with self.lock:
+            self._sync()
+            return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def col_values(self, col):
+        with self.lock:
+            self._sync()
+            return [row[col - 1] if col <= len(row) else '' for row in self.rows]
+
+    def batch_get(self, ranges, **kwargs):
+        with self.lock:
+            self._sync()
+            values = []
+            for a1 in ranges:
+                row, col = a1_to_rowcol(a1.split(':')[0])
+                cells = self.rows[row - 1] if row <= len(self.rows) else []
+                values.append([[cells[col - 1]]] if col <= len(cells) and cells[col - 1] != '' else [])
+            return values
+
+    def find(self, query):
+        with self.lock:
+            self._sync()
+            for r, row in enumerate(self.rows, start=1):
+                for c, value in enumerate(row, start=1):
+                    if value == str(query):
+                        return gspread.Cell(r, c, value)
+        return None
+
+    def update_cell(self, row, col, value):
+        with self.lock:
+            self._sync()
+            self._set(row, col, value)
+            self._save()
+
+    def batch_update(self, data, **kwargs):
+        with self.lock:
+            self._sync()
+            for update in data:
+                row, col = a1_to_rowcol(update['range'].split(':')[0])
+                for dr, values in enumerate(update['values']):
+                    for dc, value in enumerate(values):
+                        self._set(row + dr, col + dc, value)
+            self._save()
+        return {}
+
+
+def open_attendance_sheet():
+    """Connect to the attendance sheet, returning (worksheet, revision getter).
+
+    Setting ATTENDIFY_LOCAL_SHEET to a CSV path uses a LocalSheet instead of Google Sheets.
+    """
+    scope = [
+        "https://spreadsheets.google.com/feeds",
+        "https://www.googleapis.com/auth/spreadsheets",
+        "https://www.googleapis.com/auth/drive.file",
+        "https://www.googleapis.com/auth/drive"
+    ]
+    local_sheet = os.environ.get('ATTENDIFY_LOCAL_SHEET')
+    if local_sheet:
+        sheet = LocalSheet(local_sheet)
+        return sheet, sheet.revision
+    creds = ServiceAccountCredentials.from_json_keyfile_name(
+        'pathtoyourcredentials.json', scope)
+    client = gspread.authorize(creds)
+    spreadsheet = client.open('sheet_name')
+    return spreadsheet.sheet1, spreadsheet.get_lastUpdateTime
+
+
+def split_sheet_values(values):
+    """Split get_all_values() output into (header, padded rows, columns keyed by header)"""
+    header = values[0] if values else []
+    width = len(header)
+    rows = [row[:width] + [''] * (width - len(row)) for row in values[1:]]
+    columns = dict(zip(header, map(list, zip(*rows)))) if rows else {name: [] for name in header}
+    return header, rows, columns
+
+
+def sheet_roster(columns):
+    """(row index, PRN, name, section) for every sheet row with a PRN.
+
+    The name comes from the RName column when the sheet has one, else from Name;
+    a blank section falls back to Timetable.DEFAULT_SECTION.
+    """
+    names = columns['RName'] if 'RName' in columns else columns['Name']
+    sections = columns.get('Section', ())
+    return [(i, prn, names[i], (sections[i] if i < len(sections) else '') or Timetable.DEFAULT_SECTION)
+            for i, prn in enumerate(str(prn).strip() for prn in columns['PRN']) if prn]
+
+
+class SheetRefresher:
+    """Background, incremental refresh of the attendance sheet.
+
+    A refresh first asks for the sheet's revision (Drive modifiedTime, or the CSV
+    mtime for LocalSheet); when it has not moved, that one small request is all
+    the refresh costs. Otherwise the sheet is fetched and compared row by row with
+    the last load, and only the rows that differ are reported. Results are posted
+    to ``results`` for the GUI thread to apply.
+    """
+
+    def __init__(self, sheet, get_revision):
+        self.sheet = sheet
+        self.get_revision = get_revision
+        self.revision = None
+        self.header = None
+        self.rows = []
+        self.results = queue.Queue()
+        self._thread = None
+
+    def current_revision(self):
+        try:
+            return self.get_revision()
+        except Exception as e:
+            print(f"Sheet revision check failed, fetching anyway: {str(e)}")
+            return None
+
+    def prime(self, header, rows, revision):
+        """Record what the app has just loaded so the next refresh can diff against it"""
+        self.header, self.rows, self.revision = list(header), rows, revision
+
+    def invalidate(self):
+        """Forget the last load, so the next refresh reloads the whole sheet"""
+        self.header, self.revision = None, None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Run one refresh on a background thread; ignored while one is in flight"""
+        if self.running:
+            return False
+        self._thread = threading.Thread(target=self._run, name='sheet-refresh', daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        try:
+            self.results.put(self.check())
+        except Exception as e:
+            self.results.put(('error', str(e)))
+
+    def check(self):
+        """Return ('unchanged',), ('full', header, rows, columns, fetched_at) or ('rows', {row index: row}, fetched_at).
+
+        ``fetched_at`` is the wall-clock time the sheet read started.
+        """
+        revision = self.current_revision()
+        if revision is not None and revision == self.revision:
+            return ('unchanged',)
+
+        fetched_at = time.time()
+        header, rows, columns = split_sheet_values(self.sheet.get_all_values())
+        old_rows = self.rows
+        structural = header != self.header or len(rows) != len(old_rows)
+        if structural:
+            self.prime(header, rows, revision)
+            return ('full', header, rows, columns, fetched_at)
+
+        changed = {i: row for i, (row, old_row) in enumerate(zip(rows, old_rows)) if row != old_row}
+
+        prn_col = header.index('PRN')
+        if any(row[prn_col] != old_rows[i][prn_col] for i, row in changed.items()):
+            # A PRN moved, so the row index is stale: treat it as a reload
+            self.prime(header, rows, revision)
+            return ('full', header, rows, columns, fetched_at)
+
+        self.header, self.rows, self.revision = header, rows, revision
+        return ('rows', changed, fetched_at)
+
+
+class SheetIndex:
+    """PRN -> row and header -> column positions of the attendance sheet.
+
+    Built from data the app already pulls, so marking needs no sheet lookups. If the
+    sheet changes underneath it (rows or columns inserted remotely) the writer
+    notices when verifying a batch and calls rebuild().
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.cols = {}
+        self.lock = threading.Lock()
+
+    def build(self, header, prns):
+        """Index a header row and the PRNs of rows 2.. in sheet order"""
+        cols = {name: col for col, name in enumerate(header, start=1) if name}
+        rows = {str(prn).strip(): row for row, prn in enumerate(prns, start=2) if str(prn).strip()}
+        with self.lock:
+            self.rows, self.cols = rows, cols
+
+    def rebuild(self, sheet):
+        """Re-read the header row and PRN column from the sheet"""
+        header = sheet.row_values(1)
+        prn_col = header.index('PRN') + 1
+        self.build(header, sheet.col_values(prn_col)[1:])
+
+    def cell(self, prn, column):
+        with self.lock:
+            return self.rows.get(str(prn)), self.cols.get(column)
+
+
+class SheetWriteQueue:
+    """Write-behind queue that coalesces attendance marks into batched sheet updates.
+
+    ``mark`` only records the pending cell; a background thread flushes everything
+    pending in one ``batch_update`` every ``interval`` seconds, or sooner once
+    ``max_batch`` marks are waiting. Failed flushes (quota errors included) keep the
+    marks pending and retry with exponential backoff. Cells are resolved through a
+    shared SheetIndex and checked against the sheet with one batch_get per flush.
+    """
+
+    def __init__(self, sheet, index, interval=2.0, max_batch=50, max_backoff=60.0, on_written=None):
+        self.sheet = sheet
+        self.index = index
+        self.on_written = on_written
+        self.interval = interval
+        self.max_batch = max_batch
+        self.max_backoff = max_backoff
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.backoff = 0.0
+        self.retry_at = 0.0
+        self.stats = {'written': 0, 'batches': 0, 'retries': 0, 'last_error': None}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sheet-writer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the writer thread after a final flush attempt"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=10.0)
+        self.flush()
+
+    def mark(self, prn, lecture, value='Present'):
+        with self.lock:
+            self.pending[(prn, lecture)] = value
+            if len(self.pending) >= self.max_batch:
+                self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set() or time.monotonic() < self.retry_at:
+                continue
+            self.flush()
+
+    def locate(self, keys):
+        """Map (prn, lecture) keys to sheet (row, col), rebuilding the index if it has drifted"""
+        cells = {key: self.index.cell(*key) for key in keys}
+        if any(row is None or col is None for row, col in cells.values()) or self.drifted(cells):
+            self.index.rebuild(self.sheet)
+            cells = {key: self.index.cell(*key) for key in keys}
+        return cells
+
+    def drifted(self, cells):
+        """Check in one batch_get that each target row still holds its PRN and each column its header"""
+        _, prn_col = self.index.cell(None, 'PRN')
+        if prn_col is None:
+            return True
+        prn_cells = {(row, prn_col): prn for (prn, _), (row, _) in cells.items()}
+        header_cells = {(1, col): lecture for (_, lecture), (_, col) in cells.items()}
+        expected = {**prn_cells, **header_cells}
+        ranges = [rowcol_to_a1(row, col) for row, col in expected]
+        for value_range, want in zip(self.sheet.batch_get(ranges), expected.values()):
+            got = value_range[0][0] if value_range and value_range[0] else ''
+            if str(got) != str(want):
+                return True
+        return False
+
+    def flush(self):
+        """Push every pending mark in a single batch update; returns True when nothing is left pending"""
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+            if not batch:
+                return True
+
+            try:
+                cells = self.locate(batch)
+                updates = []
+                for key, value in batch.items():
+                    row, col = cells[key]
+                    if row is None or col is None:
+                        print(f"Dropping mark for PRN {key[0]} ({key[1]}): not found in sheet")
+                        continue
+                    updates.append({'range': rowcol_to_a1(row, col), 'values': [[value]]})
+                if updates:
+                    self.sheet.batch_update(updates)
+            except Exception as e:
+                with self.lock:
+                    # Newer marks for the same cell win over the ones being retried
+                    self.pending = {**batch, **self.pending}
+                self.backoff = min(self.max_backoff, max(self.interval, self.backoff * 2))
+                self.retry_at = time.monotonic() + self.backoff
+                self.stats['retries'] += 1
+                self.stats['last_error'] = str(e)
+                print(f"Sheet write failed, retrying in {self.backoff:.1f}s: {str(e)}")
+                return False
+
+            if self.on_written:
+                self.on_written(batch)
+            self.backoff = 0.0
+            self.retry_at = 0.0
+            self.stats['written'] += len(updates)
+            self.stats['batches'] += 1
+            return True
+
+
+class AttendanceStore:
+    """Local SQLite store (WAL mode) that is the source of truth for students and marks.
+
+    Every mark is committed here first, together with an outbox row that stays
+    unacknowledged until the sheet writer confirms it was written, so marks survive
+    crashes and network outages and are pushed again on the next connection.
+    Acknowledged rows are kept for ``ACK_RETENTION`` seconds with their ack time, so
+    a sheet pull that started before the write landed cannot undo the mark.
+    """
+
+    ACK_RETENTION = 3600.0
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS students (
+                prn TEXT PRIMARY KEY, name TEXT NOT NULL, position INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS attendance (
+                prn TEXT, lecture TEXT, status TEXT NOT NULL,
+                PRIMARY KEY (prn, lecture)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS outbox (
+                prn TEXT, lecture TEXT, status TEXT NOT NULL, marked_at REAL NOT NULL,
+                PRIMARY KEY (prn, lecture)) WITHOUT ROWID;
+        """)
+        student_columns = [row[1] for row in self.conn.execute("PRAGMA table_info(students)")]
+        if 'section' not in student_columns:
+            self.conn.execute(f"ALTER TABLE students ADD COLUMN section TEXT NOT NULL "
+                              f"DEFAULT '{Timetable.DEFAULT_SECTION}'")
+        outbox_columns = [row[1] for row in self.conn.execute("PRAGMA table_info(outbox)")]
+        if 'acked_at' not in outbox_columns:
+            self.conn.execute("ALTER TABLE outbox ADD COLUMN acked_at REAL")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def load_students(self, lectures):
+        """Build a students_data dict from the store, in sheet order, with every lecture column present"""
+        with self.lock:
+            students = self.conn.execute("SELECT prn, name, section FROM students ORDER BY position").fetchall()
+            attendance = self.conn.execute("SELECT prn, lecture, status FROM attendance").fetchall()
+        students_data = {
+            prn: {'name': name, 'section': section, 'attendance': {lecture: 'Absent' for lecture in lectures}}
+            for prn, name, section in students
+        }
+        for prn, lecture, status in attendance:
+            if prn in students_data:
+                students_data[prn]['attendance'][lecture] = status
+        return students_data
+
+    def _student_rows(self, prns, students_data):
+        students = []
+        attendance = []
+        for position, prn in prns:
+            data = students_data[prn]
+            students.append((prn, data['name'], position, data['section']))
+            attendance.extend((prn, lecture, status) for lecture, status in data['attendance'].items())
+        return students, attendance
+
+    def replace_students(self, students_data):
+        """Replace the roster and attendance with a freshly pulled copy of the sheet"""
+        students, attendance = self._student_rows(enumerate(students_data), students_data)
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("DELETE FROM students")
+                self.conn.execute("DELETE FROM attendance")
+                self.conn.executemany("INSERT INTO students (prn, name, position, section) VALUES (?, ?, ?, ?)",
+                                      students)
+                self.conn.executemany("INSERT INTO attendance VALUES (?, ?, ?)", attendance)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def update_students(self, prns, students_data):
+        """Upsert the given students' names and attendance"""
+        order = {prn: position for position, prn in enumerate(students_data)}
+        students, attendance = self._student_rows(((order[prn], prn) for prn in prns), students_data)
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany("INSERT OR REPLACE INTO students (prn, name, position, section) "
+                                      "VALUES (?, ?, ?, ?)", students)
+                self.conn.executemany("INSERT OR REPLACE INTO attendance VALUES (?, ?, ?)", attendance)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def mark(self, prn, lecture, status='Present'):
+        """Commit a mark and queue it for the sheet in one transaction"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("INSERT OR REPLACE INTO attendance VALUES (?, ?, ?)", (prn, lecture, status))
+                self.conn.execute("INSERT OR REPLACE INTO outbox VALUES (?, ?, ?, ?, NULL)",
+                                  (prn, lecture, status, time.time()))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def unsynced(self, fetched_at=None):
+        """Marks the sheet may not show, as {(prn, lecture): status}.
+
+        Without ``fetched_at`` these are the marks not yet confirmed written. With it,
+        marks acknowledged at or after that time are included too, since a sheet read
+        started at ``fetched_at`` may predate their write.
+        """
+        with self.lock:
+            if fetched_at is None:
+                rows = self.conn.execute("SELECT prn, lecture, status FROM outbox WHERE acked_at IS NULL "
+                                         "ORDER BY marked_at").fetchall()
+            else:
+                rows = self.conn.execute("SELECT prn, lecture, status FROM outbox "
+                                         "WHERE acked_at IS NULL OR acked_at >= ? ORDER BY marked_at",
+                                         (fetched_at,)).fetchall()
+        return {(prn, lecture): status for prn, lecture, status in rows}
+
+    def ack(self, written):
+        """Record that the sheet writer pushed these marks ({(prn, lecture): status})"""
+        now = time.time()
+        with self.lock:
+            self.conn.executemany("UPDATE outbox SET acked_at = ? "
+                                  "WHERE prn = ? AND lecture = ? AND status = ? AND acked_at IS NULL",
+                                  [(now, prn, lecture, status) for (prn, lecture), status in written.items()])
+            self.conn.execute("DELETE FROM outbox WHERE acked_at < ?", (now - self.ACK_RETENTION,))
+
+
+class TextCache:
+    """LRU cache of rendered text surfaces keyed by (font, text, color).
+
+    Nearly all text in the UI is the same from one frame to the next, so a steady
+    frame does no font rasterization. A student whose status changes simply asks
+    for a different key; the stale surface ages out. ``maxsize=0`` disables caching.
+    """
+
+    def __init__(self, maxsize=2048):
+        self.maxsize = maxsize
+        self.surfaces = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def render(self, font, text, color):
+        key = (font, text, tuple(color))
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.stats['hits'] += 1
+            return surface
+
+        self.stats['misses'] += 1
+        surface = font.render(text, True, color)
+        if self.maxsize:
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.maxsize:
+                self.surfaces.popitem(last=False)
+        return surface
+
+    def clear(self):
+        self.surfaces.clear()
+
+
+class RowTiles:
+    """Attendance list rows pre-rendered into offscreen tiles of ``rows_per_tile`` rows.
+
+    Scrolling blits a sub-rectangle of the tiles instead of drawing each row, and a
+    row is only re-rendered when its signature (name, status, lecture) changes.
+    Only tiles around the visible window are kept, so very large rosters cost a
+    bounded amount of memory.
+    """
+
+    def __init__(self, width, row_height, render_row, background, rows_per_tile=16, max_tiles=6):
+        self.width = width
+        self.row_height = row_height
+        self.render_row = render_row
+        self.background = background
+        self.rows_per_tile = rows_per_tile
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()
+
+    def _tile(self, tile_index):
+        tile = self.tiles.get(tile_index)
+        if tile is None:
+            surface = pygame.Surface((self.width, self.rows_per_tile * self.row_height)).convert()
+            surface.fill(self.background)
+            tile = self.tiles[tile_index] = (surface, [None] * self.rows_per_tile)
+        self.tiles.move_to_end(tile_index)
+        return tile
+
+    def prepare(self, first, end, signature_of):
+        """Bring rows first..end-1 up to date; returns True if any row was re-rendered"""
+        changed = False
+        for index in range(first, end):
+            surface, signatures = self._tile(index // self.rows_per_tile)
+            slot = index % self.rows_per_tile
+            signature = signature_of(index)
+            if signatures[slot] != signature:
+                y_pos = slot * self.row_height
+                surface.fill(self.background, (0, y_pos, self.width, self.row_height))
+                self.render_row(surface, index, y_pos, signature)
+                signatures[slot] = signature
+                changed = True
+
+        keep = max(self.max_tiles, (end - first) // self.rows_per_tile + 2)
+        while len(self.tiles) > keep:
+            self.tiles.popitem(last=False)
+        return changed
+
+    def blit(self, target, dest_rect, content_top, rows):
+        """Fill dest_rect with the list content starting at pixel ``content_top``"""
+        target.fill(self.background, dest_rect)
+        y = max(0, content_top)
+        bottom = min(content_top + dest_rect.height, rows * self.row_height)
+        tile_height = self.rows_per_tile * self.row_height
+        while y < bottom:
+            tile_index, tile_y = divmod(y, tile_height)
+            tile = self.tiles.get(tile_index)
+            height = min(tile_height - tile_y, bottom - y)
+            if tile is not None:
+                target.blit(tile[0], (dest_rect.x, dest_rect.y + y - content_top),
+                            pygame.Rect(0, tile_y, self.width, height))
+            y += height
+
+
+class Timetable:
+    """Timetable of sections, rooms and per-weekday lecture slots loaded from a file.
+
+    The top level ``default``/``weekdays`` slots form the ``default`` section; more
+    sections go under ``sections``, each with its own ``default``/``weekdays`` slots.
+    A slot is ``[lecture, "HH:MM", "HH:MM", room, column]`` where room and the sheet
+    column (defaults to the lecture name) are optional and both times are inclusive.
+    ``holidays`` lists ISO dates with no lectures.
+
+    Each (section, weekday) is an interval index of sorted slot starts, so a lookup
+    is a bisect, and ``current()`` caches each section's answer until its next slot
+    boundary, so callers pay nothing per frame however many slots there are.
+    """
+
+    WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+    DEFAULT_SECTION = 'default'
+    DEFAULT_SLOTS = [
+        ["Lecture1", "08:00", "09:00"],
+        ["Lecture2", "09:10", "10:10"],
+        ["Lecture3", "10:20", "11:20"],
+        ["Lecture4", "11:30", "12:30"],
+        ["Lecture5", "14:00", "15:00"],
+        ["Lecture6", "15:10", "16:10"],
+        ["Lecture7", "16:20", "17:20"],
+        ["Lecture8", "17:30", "23:30"]
+    ]
+
+    def __init__(self, sections=None, holidays=(), kiosk_room=None):
+        sections = sections or {self.DEFAULT_SECTION: {'default': self.DEFAULT_SLOTS}}
+        self.index = {}
+        self.columns = []
+        for section, config in sections.items():
+            weekdays = {day.lower(): slots for day, slots in config.get('weekdays', {}).items()}
+            unknown = set(weekdays) - set(self.WEEKDAYS)
+            if unknown:
+                raise ValueError(f"Unknown weekday in section {section}: {', '.join(sorted(unknown))}")
+            default_slots = config.get('default', [])
+            self.index[section] = [self._interval_index(section, weekdays.get(day, default_slots))
+                                   for day in self.WEEKDAYS]
+        self.holidays = {datetime.strptime(day, "%Y-%m-%d").date() for day in holidays}
+        self.kiosk_room = kiosk_room
+        self._cache = {}
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a timetable file, falling back to the built-in slots if it does not exist"""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'r') as f:
+            config = json.load(f)
+        sections = {}
+        if 'default' in config or not config.get('sections'):
+            sections[cls.DEFAULT_SECTION] = {
+                'default': config.get('default', cls.DEFAULT_SLOTS),
+                'weekdays': config.get('weekdays', {})
+            }
+        sections.update(config.get('sections', {}))
+        return cls(sections, config.get('holidays', ()), config.get('kiosk_room'))
+
+    @staticmethod
+    def _minute(hhmm):
+        hours, minutes = hhmm.split(':')
+        return int(hours) * 60 + int(minutes)
+
+    def _interval_index(self, section, slots):
+        """Sorted (starts, slots) for one section's day; overlapping slots are rejected"""
+        parsed = []
+        for entry in slots:
+            lecture, start, end = entry[:3]
+            room = entry[3] if len(entry) > 3 else None
+            column = entry[4] if len(entry) > 4 else lecture
+            parsed.append(Slot(lecture, self._minute(start), self._minute(end), room, column))
+            if column not in self.columns:
+                self.columns.append(column)
+        parsed.sort(key=lambda slot: slot.start)
+        for before, after in zip(parsed, parsed[1:]):
+            if after.start <= before.end:
+                raise ValueError(f"Overlapping slots in section {section}: {before.lecture} and {after.lecture}")
+        return [slot.start for slot in parsed], parsed
+
+    def sections(self):
+        return list(self.index)
+
+    def _lookup(self, section, weekday, minute):
+        """Return (slot or None, first minute at which the answer may change)"""
+        days = self.index.get(section) or self.index.get(self.DEFAULT_SECTION)
+        if days is None:
+            return None, 1440
+        starts, slots = days[weekday]
+        i = bisect.bisect_right(starts, minute) - 1
+        if i >= 0 and minute <= slots[i].end:
+            return slots[i], slots[i].end + 1
+        return None, starts[i + 1] if i + 1 < len(starts) else 1440
+
+    def slot_at(self, when, section=DEFAULT_SECTION):
+        """Slot running at a datetime for a section, ignoring the cache"""
+        if when.date() in self.holidays:
+            return None
+        slot, _ = self._lookup(section, when.weekday(), when.hour * 60 + when.minute)
+        return slot
+
+    def current(self, section=DEFAULT_SECTION):
+        """Slot running now for a section, recomputed only once its boundary has passed"""
+        now = time.time()
+        cached = self._cache.get(section)
+        if cached is not None and now < cached[1]:
+            return cached[0]
+
+        when = datetime.fromtimestamp(now)
+        midnight = when.replace(hour=0, minute=0, second=0, microsecond=0)
+        if when.date() in self.holidays:
+            slot, boundary = None, 1440
+        else:
+            slot, boundary = self._lookup(section, when.weekday(), when.hour * 60 + when.minute)
+        self._cache[section] = (slot, (midnight + timedelta(minutes=boundary)).timestamp())
+        return slot
 
 
 class ModernAttendanceSystem:
+    LIST_COLUMN_WIDTHS = [150, 200, 220, 120]  # PRN, Name, Current Lecture, Status
+    ACTIVE_FPS = 60
+    IDLE_TIMEOUT_MS = 500  # Longest an idle loop sleeps before checking background work
+    ACTIVE_LINGER = 2.0  # Seconds to stay at full frame rate after the last input
+    SHEET_PULL_INTERVAL = 45.0  # Seconds between background pulls of the sheet while connected
+    ANN_MIN_GALLERY = 50000  # Gallery size from which matching goes through an IVFIndex
+    MATCH_MODE = 'nearest'  # FaceGallery mode: closest reference photo ('nearest') or mean per student ('centroid')
+    GALLERY_STORAGE = 'int8'  # FaceGallery matrix dtype: 'float32', 'float16' or 'int8'
+    CAMERA_SOURCES = [0]  # Device indices, video files or stream URLs; ATTENDIFY_CAMERAS overrides
+    RECOGNITION_WORKERS = None  # Recognition processes shared by all cameras (None: one per camera up to the CPUs,
+                                # or none for a single camera)
+
     def __init__(self):
         # Initialize Pygame
         pygame.init()
@@ -42,6 +2182,8 @@ class ModernAttendanceSystem:
             'small': pygame.font.Font(None, 24)
         }
 
+        self.text_cache = TextCache()
+
         # UI Elements
         self.input_rect = pygame.Rect(50, 100, 300, 50)
         self.buttons = {
@@ -53,25 +2195,74 @@ class ModernAttendanceSystem:
         # UI State
         self.active_input = False
         self.input_text = ""
-        self.message = {'text': '', 'color': self.COLORS['text'], 'timer': 0}
+        self.message = {'text': '', 'color': self.COLORS['text'], 'expires': 0.0}
         self.scroll_offset = 0
         self.face_recognition_active = False
         self.hover_button = None
+        self.tick_mode = 'active'
+        self.last_interaction = time.monotonic()
+        self.store = None
+        self.students_data = {}
+        self.roster_prns = []
+        self.sheet = None
+        self.write_queue = None
+        self.refresher = None
+        self.refresh_requested = False
+        self.last_sheet_pull = 0.0
+        self.sheet_events = queue.Queue()
+        self.reconnect_thread = None
+        self.capture = None
+        self.recognizer = None
+        self.recent_marks = MarkDeduplicator()
+        self.preview_seq = -1
+        self.preview_surface = None
+        self.preview_stats = ''
+        self.full_redraw = True
+        self.region_state = {}
+        self.dirty_rects = []
+        self.row_tiles = None
+        self.row_tiles_roster = None
 
         # Initialize core systems
+        self.startup_timings = {}
+        try:
+            self.timetable = Timetable.from_file('timetable.json')
+        except Exception as e:
+            self.timetable = Timetable()
+            self.show_message(f"Timetable error, using default slots: {str(e)}", self.COLORS['error'])
         try:
-            self.setup_google_sheets()
-            self.setup_student_data()
-            self.setup_face_recognition()
+            self.timed('store load', self.setup_local_store)
+            try:
+                self.timed('sheets connect', self.setup_google_sheets)
+                self.setup_student_data()
+            except Exception:
+                # Keep going on the local store; marks sync once the sheet is reachable
+                self.show_message("Working offline from the local store", self.COLORS['error'])
+                self.start_reconnect()
+            self.timed('face setup', self.setup_face_recognition)
         except Exception as e:
             self.show_message(f"Initialization error: {str(e)}", self.COLORS['error'])
+        self.print_startup_timings()
+
+    def timed(self, phase, func):
+        """Run a start-up phase and record how long it took"""
+        start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            self.startup_timings[phase] = time.perf_counter() - start
+
+    def print_startup_timings(self):
+        total = sum(self.startup_timings.values())
+        phases = " | ".join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in self.startup_timings.items())
+        print(f"Startup {total * 1000:.0f} ms: {phases}")
 
     def show_message(self, text, color):
         """Display a message with a specified color for 3 seconds"""
         self.message = {
             'text': text,
             'color': color,
-            'timer': 180  # 3 seconds at 60 FPS
+            'expires': time.monotonic() + 3.0  # Wall-clock, so idle ticks don't stretch it
         }
         print(text)  # Also print to console for debugging
 
@@ -102,113 +2293,323 @@ class ModernAttendanceSystem:
     def cleanup(self):
         """Clean up resources before closing"""
         try:
-            if hasattr(self, 'cap') and self.cap is not None:
-                self.cap.release()
+            if self.recognizer is not None:
+                self.recognizer.stop()
+            if self.capture is not None:
+                self.capture.stop()
+            if self.write_queue is not None:
+                self.write_queue.stop()
+            if self.store is not None:
+                self.store.close()
             pygame.quit()
         except Exception as e:
             print(f"Cleanup error: {str(e)}")
 
+    def setup_local_store(self):
+        self.store = AttendanceStore('attendance.db')
+        self.students_data = self.store.load_students(self.timetable.columns)
+        self.roster_prns = list(self.students_data)
+
+    def open_sheet(self):
+        """Connect to the attendance sheet, returning (worksheet, revision getter)"""
+        return open_attendance_sheet()
+
     def setup_google_sheets(self):
-        scope = [
-            "https://spreadsheets.google.com/feeds",
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive.file",
-            "https://www.googleapis.com/auth/drive"
-        ]
         try:
-            creds = ServiceAccountCredentials.from_json_keyfile_name(
-                'pathtoyourcredentials.json', scope)
-            client = gspread.authorize(creds)
-            self.sheet = client.open('sheet_name').sheet1
-            self.show_message("Connected to Google Sheets", self.COLORS['success'])
+            self.attach_sheet(*self.open_sheet())
+            if isinstance(self.sheet, LocalSheet):
+                self.show_message(f"Using local sheet {self.sheet.csv_path}", self.COLORS['success'])
+            else:
+                self.show_message("Connected to Google Sheets", self.COLORS['success'])
         except Exception as e:
             self.show_message(f"Google Sheets connection failed: {str(e)}", self.COLORS['error'])
             raise
 
-    def setup_student_data(self):
+    def attach_sheet(self, sheet, get_revision):
+        """Start syncing with a connected sheet and push any marks made while offline"""
+        if self.write_queue is not None:
+            self.write_queue.stop()
+        self.sheet = sheet
+        self.refresher = SheetRefresher(self.sheet, get_revision)
+        self.last_sheet_pull = time.monotonic()
+        self.sheet_index = SheetIndex()
+        self.write_queue = SheetWriteQueue(self.sheet, self.sheet_index, on_written=self.store.ack).start()
+        for (prn, lecture), status in self.store.unsynced().items():
+            self.write_queue.mark(prn, lecture, status)
+
+    def start_reconnect(self):
+        """Retry the sheet connection in the background with backoff"""
+        if self.reconnect_thread is not None and self.reconnect_thread.is_alive():
+            return
+
+        def reconnect():
+            delay = 5.0
+            while True:
+                time.sleep(delay)
+                try:
+                    self.sheet_events.put(self.open_sheet())
+                    return
+                except Exception as e:
+                    print(f"Sheet reconnect failed: {str(e)}")
+                    delay = min(300.0, delay * 2)
+
+        self.reconnect_thread = threading.Thread(target=reconnect, name='sheet-reconnect', daemon=True)
+        self.reconnect_thread.start()
+
+    def process_sheet_events(self):
+        """Attach a sheet the reconnect thread managed to open, then pull it"""
         try:
-            self.students_data = {}
-            records = self.sheet.get_all_records()
-            for record in records:
-                prn = str(record['PRN'])  # Convert to string to handle numeric PRNs
-                name = record['RName']
-                self.students_data[prn] = {
-                    'name': name,
-                    'attendance': {f'Lecture{i}': 'Absent' for i in range(1, 9)}
-                }
-
-            # Update local attendance data from sheet
-            self.update_attendance_from_sheet()
+            sheet, get_revision = self.sheet_events.get_nowait()
+        except queue.Empty:
+            return
+        self.attach_sheet(sheet, get_revision)
+        self.refresher.start()
+        self.show_message("Reconnected to the attendance sheet", self.COLORS['success'])
 
+    def setup_student_data(self):
+        try:
+            header, rows, columns, fetched_at = self.timed('sheet fetch', self.load_sheet_table)
+            self.timed('student parse', lambda: self.apply_sheet_table(header, columns, fetched_at))
         except Exception as e:
             self.show_message(f"Error loading student data: {str(e)}", self.COLORS['error'])
             raise
 
+    def load_sheet_table(self):
+        """Fetch the whole sheet in one call and split it into columns keyed by header"""
+        revision = self.refresher.current_revision()
+        fetched_at = time.time()
+        header, rows, columns = split_sheet_values(self.sheet.get_all_values())
+        self.refresher.prime(header, rows, revision)
+        return header, rows, columns, fetched_at
+
+    def apply_sheet_table(self, header, columns, fetched_at):
+        """Rebuild students_data and the sheet index from a columnar sheet table"""
+        lectures = self.timetable.columns
+        lecture_columns = [columns.get(lecture, ()) for lecture in lectures]
+
+        students_data = {}
+        for i, prn, name, section in sheet_roster(columns):
+            students_data[prn] = {
+                'name': name,
+                'section': section,
+                'attendance': {lecture: (column[i] if i < len(column) and column[i] else 'Absent')
+                               for lecture, column in zip(lectures, lecture_columns)}
+            }
+
+        self.overlay_unsynced(students_data, fetched_at)
+        self.store.replace_students(students_data)
+        self.sheet_index.build(header, columns['PRN'])
+        self.students_data = students_data
+        self.roster_prns = list(students_data)
+
+    def apply_sheet_rows(self, header, changed_rows, fetched_at):
+        """Patch students_data in place with rows that changed since the last load"""
+        prn_col = header.index('PRN')
+        name_col = header.index('RName') if 'RName' in header else header.index('Name')
+        section_col = header.index('Section') if 'Section' in header else None
+        lecture_cols = {lecture: header.index(lecture) for lecture in self.timetable.columns if lecture in header}
+        changed = []
+        for row in changed_rows.values():
+            student = self.students_data.get(str(row[prn_col]).strip())
+            if student is None:
+                continue
+            student['name'] = row[name_col]
+            if section_col is not None:
+                student['section'] = row[section_col] or Timetable.DEFAULT_SECTION
+            for lecture, col in lecture_cols.items():
+                student['attendance'][lecture] = row[col] or 'Absent'
+            changed.append(str(row[prn_col]).strip())
+        self.overlay_unsynced(self.students_data, fetched_at)
+        self.store.update_students(changed, self.students_data)
+
+    def overlay_unsynced(self, students_data, fetched_at):
+        """Local marks a sheet read started at ``fetched_at`` may not show are newer than what it says"""
+        for (prn, lecture), status in self.store.unsynced(fetched_at).items():
+            if prn in students_data:
+                students_data[prn]['attendance'][lecture] = status
+
     def update_attendance_from_sheet(self):
-        """Update local attendance data from Google Sheet"""
+        """Start a background refresh; results are applied by process_refresh_results"""
+        if self.refresher is None:
+            self.show_message("Error refreshing data: not connected to a sheet", self.COLORS['error'])
+            return
+        # A periodic pull already in flight answers this request too
+        self.refresher.start()
+        self.refresh_requested = True
+        self.last_sheet_pull = time.monotonic()
+        self.show_message("Refreshing data...", self.COLORS['text'])
+
+    def pull_sheet_if_due(self):
+        """Quietly refresh from the sheet every SHEET_PULL_INTERVAL seconds, so remote edits show up"""
+        if self.refresher is None or time.monotonic() - self.last_sheet_pull < self.SHEET_PULL_INTERVAL:
+            return
+        self.last_sheet_pull = time.monotonic()
+        self.refresher.start()
+
+    def process_refresh_results(self):
+        """Apply a finished background refresh on the GUI thread"""
+        if self.refresher is None:
+            return
         try:
-            all_values = self.sheet.get_all_records()
-            self.students_data = {}
-            for record in all_values:
-                prn = str(record['PRN'])
-                name = record['RName']
-                self.students_data[prn] = {
-                    'name': name,
-                    'attendance': {f'Lecture{i}': record.get(f'Lecture{i}', 'Absent') for i in range(1, 9)}
-                }
-            self.show_message("Data refreshed successfully", self.COLORS['success'])
+            result = self.refresher.results.get_nowait()
+        except queue.Empty:
+            return
+
+        # Periodic pulls only speak up about errors
+        requested, self.refresh_requested = self.refresh_requested, False
+        kind = result[0]
+        if kind == 'error':
+            self.show_message(f"Error refreshing data: {result[1]}", self.COLORS['error'])
+            return
+        try:
+            if kind == 'full':
+                _, header, _, columns, fetched_at = result
+                self.apply_sheet_table(header, columns, fetched_at)
+            elif kind == 'rows':
+                _, changed_rows, fetched_at = result
+                self.apply_sheet_rows(self.refresher.header, changed_rows, fetched_at)
         except Exception as e:
+            # A renamed column or a store error: keep the current data and reload it all next time
+            self.refresher.invalidate()
             self.show_message(f"Error refreshing data: {str(e)}", self.COLORS['error'])
+            return
+
+        if not requested:
+            return
+        if kind == 'unchanged':
+            self.show_message("Data is up to date", self.COLORS['success'])
+        else:
+            self.show_message("Data refreshed successfully", self.COLORS['success'])
 
     def setup_face_recognition(self):
-        self.face_encodings = {}
+        self.face_gallery = FaceGallery(mode=self.MATCH_MODE, storage=self.GALLERY_STORAGE)
         self.path = 'images'
+        self.cache_dir = 'face_cache'
+        self.enrollment_progress = {'done': 0, 'total': 0, 'failed': 0}
+        self.encoding_cache = None
         if not os.path.exists(self.path):
             os.makedirs(self.path)
 
         try:
-            for image_file in os.listdir(self.path):
-                if image_file.endswith(('.jpg', '.jpeg', '.png')):
-                    prn = image_file.split('.')[0]
-                    image_path = os.path.join(self.path, image_file)
-                    self.add_face_encoding(prn, image_path)
+            self.encoding_cache = EncodingCache(self.cache_dir).load()
+            encodings, errors = load_reference_encodings(self.path, self.encoding_cache,
+                                                         on_progress=self.draw_enrollment_progress)
+            # The gallery is the only in-memory copy; the cache has every photo's encoding on disk
+            self.face_gallery = FaceGallery.from_encodings(
+                {prn: list(samples.values()) for prn, samples in encodings.items()},
+                mode=self.MATCH_MODE, storage=self.GALLERY_STORAGE)
+            self.encoding_cache.save()
+            if self.face_gallery.samples >= self.ANN_MIN_GALLERY:
+                self.start_gallery_index()
+
+            total = self.enrollment_progress['total']
+            if errors:
+                self.show_message(f"Enrolled {total - len(errors)} faces, {len(errors)} failed (see console)",
+                                  self.COLORS['error'])
+            elif total:
+                self.show_message(f"Enrolled {total} faces", self.COLORS['success'])
         except Exception as e:
             self.show_message(f"Face recognition setup error: {str(e)}", self.COLORS['error'])
 
-    def add_face_encoding(self, prn, image_path):
+    def start_gallery_index(self):
+        """Match through the IVFIndex saved in the cache folder, or train one in the background.
+
+        A saved index is only used for exactly the gallery it was built over. Until
+        a new one is trained, matching uses the exact scan.
+        """
+        path = os.path.join(self.cache_dir, IVFIndex.SAVE_FILE)
+        index = IVFIndex.load(path, self.face_gallery.fingerprint())
+        if index is not None:
+            self.face_gallery.index = index
+            return
+
+        def train():
+            try:
+                self.face_gallery.train_index(IVFIndex(), path)
+            except Exception as e:
+                print(f"Could not build the face index: {str(e)}")
+
+        threading.Thread(target=train, name='face-index', daemon=True).start()
+
+    def draw_enrollment_progress(self, done, total, failed):
+        """Render an enrollment progress bar while faces are encoded at start-up"""
+        self.enrollment_progress = progress = {'done': done, 'total': total, 'failed': failed}
+        pygame.event.pump()
+        self.screen.fill(self.COLORS['background'])
+        label = f"Enrolling faces: {progress['done']}/{progress['total']}"
+        if progress['failed']:
+            label += f" ({progress['failed']} failed)"
+        text = self.fonts['medium'].render(label, True, self.COLORS['text'])
+        self.screen.blit(text, (50, 100))
+
+        bar_rect = pygame.Rect(50, 150, self.SCREEN_WIDTH - 100, 30)
+        pygame.draw.rect(self.screen, self.COLORS['secondary'], bar_rect, border_radius=5)
+        fill_rect = bar_rect.copy()
+        fill_rect.width = int(bar_rect.width * progress['done'] / progress['total'])
+        pygame.draw.rect(self.screen, self.COLORS['primary'], fill_rect, border_radius=5)
+        pygame.display.flip()
+
+    def enroll_new_photos(self):
+        """Enroll photos added to or replaced in the images folder since start-up; returns how many.
+
+        Runs with every Refresh, so a new student's photo needs no restart. Each
+        photo is encoded on the GUI thread behind the enrollment progress bar.
+        """
+        if self.encoding_cache is None:
+            return 0
+        new = [(prn, image_path) for image_file, prn, image_path in reference_images(self.path)
+               if not self.encoding_cache.known(image_file, image_path)]
+        enrolled = 0
+        for done, (prn, image_path) in enumerate(new):
+            self.draw_enrollment_progress(done, len(new), done - enrolled)
+            enrolled += self.add_face_encoding(prn, image_path)
+        if new:
+            try:
+                self.encoding_cache.save()
+            except Exception as e:
+                print(f"Could not update encoding cache: {str(e)}")
+        return enrolled
+
+    def encode_face(self, prn, image_path):
+        """Compute the encoding of the first face in an image: (encoding, None) or (None, error)"""
         try:
-            image = face_recognition.load_image_file(image_path)
-            encoding = face_recognition.face_encodings(image)[0]
-            self.face_encodings[prn] = encoding
-            return True
+            return encode_image(image_path), None
         except Exception as e:
             self.show_message(f"Error encoding face for PRN {prn}: {str(e)}", self.COLORS['error'])
-            return False
-
-    def get_current_lecture(self):
-        lectures = {
-            "Lecture1": ("08:00", "09:00"),
-            "Lecture2": ("09:10", "10:10"),
-            "Lecture3": ("10:20", "11:20"),
-            "Lecture4": ("11:30", "12:30"),
-            "Lecture5": ("14:00", "15:00"),
-            "Lecture6": ("15:10", "16:10"),
-            "Lecture7": ("16:20", "17:20"),
-            "Lecture8": ("17:30", "23:30")
-        }
+            return None, str(e)
 
-        now = datetime.now().strftime("%H:%M")
-        for lecture, (start, end) in lectures.items():
-            if start <= now <= end:
-                return lecture
-        return None
+    def add_face_encoding(self, prn, image_path):
+        """Enroll one reference photo; the student is matched against all of their photos.
 
-    def mark_attendance(self, prn):
-        current_lecture = self.get_current_lecture()
-        if not current_lecture:
-            self.show_message("No active lecture at this time", self.COLORS['error'])
+        The photo is recorded in the encoding cache, failed or not; the caller saves it.
+        """
+        image_file = os.path.relpath(image_path, self.path).replace(os.sep, '/')
+        encoding, error = self.encode_face(prn, image_path)
+        try:
+            if encoding is None:
+                self.encoding_cache.put_error(image_file, image_path, prn, error)
+            else:
+                self.encoding_cache.put(image_file, image_path, prn, encoding)
+        except Exception as e:
+            print(f"Could not update encoding cache: {str(e)}")
+        if encoding is None:
             return False
+        # The student's other photos come back from the cache, not from a copy kept in memory
+        samples = self.encoding_cache.encodings_for(prn)
+        samples[image_file] = encoding
+        self.face_gallery.add(prn, list(samples.values()))
+        return True
+
+    def get_current_lecture(self, prn=None):
+        """Slot running now for a student's section (or the default section), or None"""
+        student = self.students_data.get(prn) if prn is not None else None
+        section = student['section'] if student else Timetable.DEFAULT_SECTION
+        slot = self.timetable.current(section)
+        if slot is not None and slot.room and self.timetable.kiosk_room and slot.room != self.timetable.kiosk_room:
+            return None  # This section's lecture is in another room
+        return slot
 
+    def mark_attendance(self, prn):
         prn = str(prn).strip()  # Clean the PRN
         if not prn:
             self.show_message("Please enter a valid PRN", self.COLORS['error'])
@@ -218,32 +2619,28 @@ class ModernAttendanceSystem:
             self.show_message(f"PRN {prn} not found", self.COLORS['error'])
             return False
 
+        slot = self.get_current_lecture(prn)
+        if not slot:
+            self.show_message("No active lecture at this time", self.COLORS['error'])
+            return False
+        current_lecture = slot.column
+
         student = self.students_data[prn]
-        if student['attendance'][current_lecture] == 'Present':
+        if student['attendance'].get(current_lecture) == 'Present':
             self.show_message(f"Already marked present: {student['name']}", self.COLORS['error'])
             return False
 
+        # Commit locally first; the write queue pushes it to the sheet in the next batch
         try:
-            # Find PRN in sheet
-            cell = self.sheet.find(prn)
-            if cell:
-                row_num = cell.row
-                col_num = self.sheet.find(current_lecture).col
-
-                # Update Google Sheet
-                self.sheet.update_cell(row_num, col_num, 'Present')
-
-                # Update local data
-                student['attendance'][current_lecture] = 'Present'
-                self.show_message(f"Marked present: {student['name']}", self.COLORS['success'])
-                return True
-            else:
-                self.show_message("Error: PRN not found in sheet", self.COLORS['error'])
-                return False
-
+            self.store.mark(prn, current_lecture)
         except Exception as e:
             self.show_message(f"Error marking attendance: {str(e)}", self.COLORS['error'])
             return False
+        student['attendance'][current_lecture] = 'Present'
+        if self.write_queue is not None:
+            self.write_queue.mark(prn, current_lecture)
+        self.show_message(f"Marked present: {student['name']}", self.COLORS['success'])
+        return True
 
     def handle_manual_entry(self):
         """Process manual PRN entry"""
@@ -257,62 +2654,75 @@ class ModernAttendanceSystem:
             self.input_text = ""  # Clear input after successful marking
 
     def process_face_recognition(self):
+        """Apply results the recognition worker posted since the last tick"""
         if not self.face_recognition_active:
             return
 
-        try:
-            ret, frame = self.cap.read()
-            if ret:
-                # Convert the frame from BGR to RGB
-                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-                # Resize frame for faster face recognition
-                small_frame = cv2.resize(rgb_frame, (0, 0), fx=0.25, fy=0.25)
-
-                # Find all faces in the frame
-                face_locations = face_recognition.face_locations(small_frame)
-                face_encodings = face_recognition.face_encodings(small_frame, face_locations)
-
-                # Check each face against known faces
-                for face_encoding in face_encodings:
-                    matches = []
-                    for prn, known_encoding in self.face_encodings.items():
-                        match = face_recognition.compare_faces([known_encoding], face_encoding, tolerance=0.6)[0]
-                        if match:
-                            matches.append(prn)
-
-                    # Mark attendance for matched faces
-                    if matches:
-                        for prn in matches:
-                            self.mark_attendance(prn)
-
-                # Display the camera feed
-                frame = cv2.flip(frame, 1)  # Mirror the feed
-                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                surface = pygame.surfarray.make_surface(np.rot90(rgb_frame))
-                scaled_surface = pygame.transform.scale(surface, (400, 300))
-                self.screen.blit(scaled_surface, (self.SCREEN_WIDTH - 420, 20))
+        while True:
+            try:
+                result = self.recognizer.results.get_nowait()
+            except queue.Empty:
+                break
 
-        except Exception as e:
-            self.show_message(f"Face recognition error: {str(e)}", self.COLORS['error'])
-            self.toggle_face_recognition()  # Turn off face recognition on error
+            if isinstance(result, tuple) and result[0] == 'error':
+                self.show_message(f"Face recognition error: {result[1]}", self.COLORS['error'])
+                self.toggle_face_recognition()  # Turn off face recognition on error
+                return
+
+            for match in result.matches:
+                if match.prn is None:
+                    continue
+                # Another camera may report a student who was just marked for this lecture
+                slot = self.get_current_lecture(match.prn)
+                key = (match.prn, slot.column if slot else None)
+                if self.recent_marks.recent(key):
+                    continue
+                if self.mark_attendance(match.prn):
+                    self.recent_marks.record(key)
+
+    def update_camera_preview(self):
+        """Convert the newest captured frame into the preview surface if a new one arrived"""
+        if self.capture is None:
+            return
+        latest = self.capture.peek(self.preview_seq)
+        if latest is not None:
+            self.preview_seq, _, frame = latest
+            frame = cv2.flip(frame, 1)  # Mirror the feed
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            surface = pygame.surfarray.make_surface(np.rot90(rgb_frame))
+            self.preview_surface = pygame.transform.scale(surface, (400, 300))
+            stats = self.capture.stats
+            self.preview_stats = (f"Capture {stats['latency_ms']:.1f} ms | dropped {stats['dropped']}"
+                                  f" | recognition {self.recognizer.stats['latency_ms']:.0f} ms"
+                                  f" | skipped {self.recognizer.stats['skipped']}")
+
+    def draw_camera_preview(self):
+        self.screen.blit(self.preview_surface, (self.SCREEN_WIDTH - 420, 20))
+        stats_surface = self.fonts['small'].render(self.preview_stats, True, self.COLORS['text_dim'])
+        self.screen.blit(stats_surface, (self.SCREEN_WIDTH - 420, 325))
 
     def toggle_face_recognition(self):
         if not self.face_recognition_active:
-            if len(self.face_encodings) == 0:
+            if len(self.face_gallery) == 0:
                 self.show_message("No face recognition data available", self.COLORS['error'])
                 return
             try:
-                self.cap = cv2.VideoCapture(0)
-
-                if not self.cap.isOpened():
-                    raise Exception("Could not open camera")
+                sources = self.CAMERA_SOURCES
+                if os.environ.get('ATTENDIFY_CAMERAS'):
+                    sources = camera_sources(os.environ['ATTENDIFY_CAMERAS'])
+                self.recognizer = RecognitionPool.open(sources, self.face_gallery,
+                                                       workers=self.RECOGNITION_WORKERS).start()
+                self.capture = self.recognizer.captures[0]  # The preview shows the first camera
+                self.preview_seq = -1
+                self.preview_surface = None
                 self.face_recognition_active = True
                 self.show_message("Face recognition activated", self.COLORS['success'])
             except Exception as e:
                 self.show_message(f"Camera error: {str(e)}", self.COLORS['error'])
         else:
-            self.cap.release()
+            self.recognizer.stop()
+            self.recognizer = None
+            self.capture = None
             self.face_recognition_active = False
             self.show_message("Face recognition deactivated", self.COLORS['text'])
 
@@ -330,99 +2740,249 @@ class ModernAttendanceSystem:
             'refresh': pygame.Rect(50, 240, 300, 50),
             'manual_entry': pygame.Rect(50, 310, 300, 50)
         }
+        self.full_redraw = True
 
     def handle_resize(self, event):
         """Handle window resize events"""
         if event.type == pygame.VIDEORESIZE:
             self.update_screen_size()
 
+    def draw_region(self, key, rect, state, draw=None, background=None):
+        """Redraw a screen region only when its state differs from what was last drawn there.
+
+        The region is cleared to ``background`` and, unless ``state`` is None, painted
+        by ``draw``; its rect is queued for the next pygame.display.update.
+        """
+        if not self.full_redraw and key in self.region_state and self.region_state[key] == state:
+            return
+        self.screen.fill(background or self.COLORS['background'], rect)
+        if state is not None and draw is not None:
+            self.screen.set_clip(rect)
+            draw()
+            self.screen.set_clip(None)
+        self.region_state[key] = state
+        self.dirty_rects.append(rect)
+
+    def present(self):
+        """Push this tick's drawing to the display: everything after a full redraw, else dirty rects"""
+        if self.full_redraw:
+            pygame.display.flip()
+        elif self.dirty_rects:
+            pygame.display.update(self.dirty_rects)
+        self.full_redraw = False
+        self.dirty_rects = []
+
     def draw_ui(self):
-        # Draw title
-        title = self.fonts['title'].render("Attendance System", True, self.COLORS['text'])
-        self.screen.blit(title, (50, 30))
+        if self.full_redraw:
+            self.screen.fill(self.COLORS['background'])
+            self.region_state = {}
+
+            # Draw title
+            title = self.text_cache.render(self.fonts['title'], "Attendance System", self.COLORS['text'])
+            self.screen.blit(title, (50, 30))
 
         # Draw input box
+        self.draw_region('input', self.input_rect, (self.active_input, self.input_text), self.draw_input_box)
+
+        # Draw buttons
+        for name, rect in self.buttons.items():
+            self.draw_region(('button', name), rect, name == self.hover_button,
+                             lambda name=name, rect=rect: self.draw_button(name, rect))
+
+        # Draw message
+        message_area = pygame.Rect(50, 360, self.SCREEN_WIDTH - 100, 40)
+        if time.monotonic() < self.message['expires']:
+            message_state = (self.message['text'], self.message['color'])
+        else:
+            message_state = None
+        self.draw_region('message', message_area, message_state, self.draw_message)
+
+        # Draw camera preview
+        preview_area = pygame.Rect(self.SCREEN_WIDTH - 420, 20, 400, 330)
+        if self.capture is not None and self.preview_surface is not None:
+            preview_state = (self.preview_seq, self.preview_stats)
+        else:
+            preview_state = None
+        self.draw_region('camera', preview_area, preview_state, self.draw_camera_preview)
+
+        # Draw attendance list
+        self.draw_attendance_list()
+
+    def draw_input_box(self):
         pygame.draw.rect(self.screen,
                          self.COLORS['primary'] if self.active_input else self.COLORS['secondary'],
                          self.input_rect, border_radius=5)
 
         if self.input_text:
-            text_surface = self.fonts['medium'].render(self.input_text, True, self.COLORS['text'])
+            text_surface = self.text_cache.render(self.fonts['medium'], self.input_text, self.COLORS['text'])
         else:
-            text_surface = self.fonts['medium'].render("Enter PRN...", True, self.COLORS['text_dim'])
+            text_surface = self.text_cache.render(self.fonts['medium'], "Enter PRN...", self.COLORS['text_dim'])
         text_rect = text_surface.get_rect(midleft=(self.input_rect.x + 10, self.input_rect.centery))
         self.screen.blit(text_surface, text_rect)
 
-        # Draw buttons
+    def draw_button(self, name, rect):
         button_texts = {
             'face_recognition': 'Face Recognition',
             'refresh': 'Refresh Data',
             'manual_entry': 'Manual Entry'
         }
-
-        for name, rect in self.buttons.items():
-            color = self.COLORS['button_hover'] if name == self.hover_button else self.COLORS['button']
-            pygame.draw.rect(self.screen, color, rect, border_radius=5)
-            text = self.fonts['medium'].render(button_texts[name], True, self.COLORS['text'])
-            text_rect = text.get_rect(center=rect.center)
-            self.screen.blit(text, text_rect)
-
-            # Draw message
-        if self.message['timer'] > 0:
-            message_surface = self.fonts['medium'].render(self.message['text'], True, self.message['color'])
-            message_rect = message_surface.get_rect(midleft=(50, 380))
-            self.screen.blit(message_surface, message_rect)
-            self.message['timer'] -= 1
-
-            # Draw attendance list
-        self.draw_attendance_list()
+        color = self.COLORS['button_hover'] if name == self.hover_button else self.COLORS['button']
+        pygame.draw.rect(self.screen, color, rect, border_radius=5)
+        text = self.text_cache.render(self.fonts['medium'], button_texts[name], self.COLORS['text'])
+        text_rect = text.get_rect(center=rect.center)
+        self.screen.blit(text, text_rect)
+
+    def draw_message(self):
+        message_surface = self.text_cache.render(self.fonts['medium'], self.message['text'],
+                                                 self.message['color'])
+        message_rect = message_surface.get_rect(midleft=(50, 380))
+        self.screen.blit(message_surface, message_rect)
 
     def draw_attendance_list(self):
-        """Draw the scrollable attendance list"""
-        # List background
+        """Draw the scrollable attendance list by blitting its pre-rendered row tiles"""
         list_rect = pygame.Rect(50, 420, self.SCREEN_WIDTH - 100, self.SCREEN_HEIGHT - 470)
-        pygame.draw.rect(self.screen, self.COLORS['secondary'], list_rect, border_radius=5)
-
-        # Headers
-        headers = ['PRN', 'Name', 'Current Lecture', 'Status']
-        header_widths = [150, 200, 220, 120]  # Increased widths for columns
-        x_pos = list_rect.x + 20
-        for header, width in zip(headers, header_widths):
-            header_surface = self.fonts['medium'].render(header, True, self.COLORS['text'])
-            self.screen.blit(header_surface, (x_pos, list_rect.y + 10))
-            x_pos += width
-
-        # Student entries
-        current_lecture = self.get_current_lecture() or "No Active Lecture"
-        y_pos = list_rect.y + 50 + self.scroll_offset
+        rows_rect = pygame.Rect(list_rect.x, list_rect.y + 45, list_rect.width, list_rect.height - 50)
+        list_state = list_rect.size
+        repaint = self.full_redraw or self.region_state.get('list') != list_state
+        if repaint:
+            self.screen.fill(self.COLORS['background'], list_rect)
+            pygame.draw.rect(self.screen, self.COLORS['secondary'], list_rect, border_radius=5)
+
+            # Headers
+            headers = ['PRN', 'Name', 'Current Lecture', 'Status']
+            x_pos = list_rect.x + 20
+            for header, width in zip(headers, self.LIST_COLUMN_WIDTHS):
+                header_surface = self.text_cache.render(self.fonts['medium'], header, self.COLORS['text'])
+                self.screen.blit(header_surface, (x_pos, list_rect.y + 10))
+                x_pos += width
+            self.region_state['list'] = list_state
+            self.dirty_rects.append(list_rect)
+
+        # A new roster or a resize invalidates every pre-rendered row
         line_height = 40
+        if (self.row_tiles is None or self.row_tiles.width != list_rect.width
+                or self.row_tiles_roster is not self.roster_prns):
+            self.row_tiles = RowTiles(list_rect.width, line_height, self.draw_list_row,
+                                      self.COLORS['secondary'])
+            self.row_tiles_roster = self.roster_prns
+
+        # Student entries: only the window of rows that intersects the list body is touched
+        first_y = list_rect.y + 50 + self.scroll_offset
+        first = max(0, (rows_rect.top - first_y) // line_height)
+        end = min(len(self.roster_prns), -((first_y - rows_rect.bottom) // line_height))
+
+        def signature(index):
+            prn = self.roster_prns[index]
+            data = self.students_data[prn]
+            slot = self.get_current_lecture(prn)
+            if slot is None:
+                return data['name'], 'Absent', "No Active Lecture"
+            return data['name'], data['attendance'].get(slot.column, 'Absent'), slot.lecture
+
+        rows_changed = self.row_tiles.prepare(first, end, signature)
+        view_state = (rows_rect.size, self.scroll_offset)
+        if repaint or rows_changed or self.region_state.get('list_view') != view_state:
+            self.row_tiles.blit(self.screen, rows_rect, rows_rect.top - first_y, len(self.roster_prns))
+            self.region_state['list_view'] = view_state
+            self.dirty_rects.append(rows_rect)
+
+    def draw_list_row(self, surface, index, y_pos, signature):
+        """Render one attendance row onto a row tile"""
+        prn = self.roster_prns[index]
+        name, status, lecture = signature
+        x_pos = 20
+
+        # PRN
+        prn_surface = self.text_cache.render(self.fonts['small'], prn, self.COLORS['text'])
+        surface.blit(prn_surface, (x_pos, y_pos))
+        x_pos += self.LIST_COLUMN_WIDTHS[0]
+
+        # Name
+        name_surface = self.text_cache.render(self.fonts['small'], name, self.COLORS['text'])
+        surface.blit(name_surface, (x_pos, y_pos))
+        x_pos += self.LIST_COLUMN_WIDTHS[1]
+
+        # Current Lecture
+        lecture_surface = self.text_cache.render(self.fonts['small'], lecture, self.COLORS['text'])
+        surface.blit(lecture_surface, (x_pos, y_pos))
+        x_pos += self.LIST_COLUMN_WIDTHS[2]
+
+        # Status
+        status_color = self.COLORS['present'] if status == 'Present' else self.COLORS['absent']
+        status_surface = self.text_cache.render(self.fonts['small'], status, status_color)
+        surface.blit(status_surface, (x_pos, y_pos))
+
+    def choose_tick_mode(self):
+        """'active' (60 FPS) while the camera runs or someone is using the kiosk, else 'idle'"""
+        if self.face_recognition_active or time.monotonic() - self.last_interaction < self.ACTIVE_LINGER:
+            return 'active'
+        return 'idle'
+
+    def next_events(self):
+        """Events for this tick; in idle mode, block until one arrives or the idle timeout passes"""
+        if self.tick_mode == 'idle':
+            event = pygame.event.wait(self.IDLE_TIMEOUT_MS)
+            if event.type == pygame.NOEVENT:
+                return []
+            return [event] + pygame.event.get()
+        return pygame.event.get()
+
+    def handle_event(self, event):
+        """Handle one pygame event; returns False when the app should quit"""
+        if event.type == pygame.QUIT:
+            return False
 
-        for prn, data in self.students_data.items():
-            if y_pos + line_height > list_rect.y and y_pos < list_rect.bottom:
-                x_pos = list_rect.x + 20
-
-                # PRN
-                prn_surface = self.fonts['small'].render(prn, True, self.COLORS['text'])
-                self.screen.blit(prn_surface, (x_pos, y_pos))
-                x_pos += header_widths[0]
-
-                # Name
-                name_surface = self.fonts['small'].render(data['name'], True, self.COLORS['text'])
-                self.screen.blit(name_surface, (x_pos, y_pos))
-                x_pos += header_widths[1]
-
-                # Current Lecture
-                lecture_surface = self.fonts['small'].render(current_lecture, True, self.COLORS['text'])
-                self.screen.blit(lecture_surface, (x_pos, y_pos))
-                x_pos += header_widths[2]
+        elif event.type == pygame.MOUSEBUTTONDOWN:
+            mouse_pos = pygame.mouse.get_pos()
 
-                # Status
-                status = data['attendance'].get(current_lecture, 'Absent')
-                status_color = self.COLORS['present'] if status == 'Present' else self.COLORS['absent']
-                status_surface = self.fonts['small'].render(status, True, status_color)
-                self.screen.blit(status_surface, (x_pos, y_pos))
+            # Handle input box click
+            if self.input_rect.collidepoint(mouse_pos):
+                self.active_input = not self.active_input
+            else:
+                self.active_input = False
+
+            # Handle button clicks
+            for name, rect in self.buttons.items():
+                if rect.collidepoint(mouse_pos):
+                    if name == 'face_recognition':
+                        self.toggle_face_recognition()
+                    elif name == 'refresh':
+                        self.update_attendance_from_sheet()
+                        enrolled = self.enroll_new_photos()
+                        if enrolled:
+                            self.show_message(f"Enrolled {enrolled} new faces", self.COLORS['success'])
+                    elif name == 'manual_entry':
+                        self.handle_manual_entry()
+
+            # Handle scrolling
+            if event.button in (4, 5):  # Mouse wheel up (4) or down (5)
+                self.scroll_offset += 30 if event.button == 4 else -30
+                max_scroll = -len(self.roster_prns) * 40 + self.SCREEN_HEIGHT - 470
+                self.scroll_offset = min(0, max(max_scroll, self.scroll_offset))
+
+        elif event.type == pygame.KEYDOWN:
+            if self.active_input:
+                if event.key == pygame.K_RETURN:
+                    self.handle_manual_entry()
+                elif event.key == pygame.K_BACKSPACE:
+                    self.input_text = self.input_text[:-1]
+                else:
+                    if len(self.input_text) < 12:  # Limit input length
+                        self.input_text += event.unicode
+
+        elif event.type == pygame.MOUSEMOTION:
+            # Handle button hover effects
+            mouse_pos = pygame.mouse.get_pos()
+            self.hover_button = None
+            for name, rect in self.buttons.items():
+                if rect.collidepoint(mouse_pos):
+                    self.hover_button = name
+                    break
+
+        elif event.type == pygame.VIDEOEXPOSE:
+            self.full_redraw = True
 
-            y_pos += line_height
+        return True
 
     def run(self):
         """Main application loop"""
@@ -431,66 +2991,146 @@ class ModernAttendanceSystem:
 
         while running:
             # Handle events
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
+            events = self.next_events()
+            if events:
+                self.last_interaction = time.monotonic()
+            for event in events:
+                if not self.handle_event(event):
                     running = False
 
-                elif event.type == pygame.MOUSEBUTTONDOWN:
-                    mouse_pos = pygame.mouse.get_pos()
-
-                    # Handle input box click
-                    if self.input_rect.collidepoint(mouse_pos):
-                        self.active_input = not self.active_input
-                    else:
-                        self.active_input = False
-
-                    # Handle button clicks
-                    for name, rect in self.buttons.items():
-                        if rect.collidepoint(mouse_pos):
-                            if name == 'face_recognition':
-                                self.toggle_face_recognition()
-                            elif name == 'refresh':
-                                self.update_attendance_from_sheet()
-                            elif name == 'manual_entry':
-                                self.handle_manual_entry()
-
-                    # Handle scrolling
-                    if event.button in (4, 5):  # Mouse wheel up (4) or down (5)
-                        self.scroll_offset += 30 if event.button == 4 else -30
-                        max_scroll = -len(self.students_data) * 40 + self.SCREEN_HEIGHT - 470
-                        self.scroll_offset = min(0, max(max_scroll, self.scroll_offset))
-
-                elif event.type == pygame.KEYDOWN:
-                    if self.active_input:
-                        if event.key == pygame.K_RETURN:
-                            self.handle_manual_entry()
-                        elif event.key == pygame.K_BACKSPACE:
-                            self.input_text = self.input_text[:-1]
-                        else:
-                            if len(self.input_text) < 12:  # Limit input length
-                                self.input_text += event.unicode
-
-                elif event.type == pygame.MOUSEMOTION:
-                    # Handle button hover effects
-                    mouse_pos = pygame.mouse.get_pos()
-                    self.hover_button = None
-                    for name, rect in self.buttons.items():
-                        if rect.collidepoint(mouse_pos):
-                            self.hover_button = name
-                            break
-
             # Update screen
-            self.screen.fill(self.COLORS['background'])
+            self.process_sheet_events()
+            self.pull_sheet_if_due()
+            self.process_refresh_results()
             if self.face_recognition_active:
                 self.process_face_recognition()
+                self.update_camera_preview()
             self.draw_ui()
-            pygame.display.flip()
-            clock.tick(60)
+            self.present()
+
+            # Full frame rate only while there is something to animate or react to
+            self.tick_mode = self.choose_tick_mode()
+            if self.tick_mode == 'active':
+                clock.tick(self.ACTIVE_FPS)
 
         # Perform cleanup after the loop ends
         self.cleanup()
 
 
+def batch_main(argv=None):
+    """Headless entry point: mark attendance from a recording without opening the GUI"""
+    parser = argparse.ArgumentParser(
+        prog='attendifyme.py batch',
+        description="Mark attendance from a recorded video or a folder of images without opening the GUI.")
+    parser.add_argument('source', help="video file or folder of images")
+    lecture_group = parser.add_mutually_exclusive_group(required=True)
+    lecture_group.add_argument('--lecture', help="sheet column to mark for every student seen")
+    lecture_group.add_argument('--at', help="recording time 'YYYY-MM-DD HH:MM'; each student's lecture "
+                                            "is looked up in the timetable for their section")
+    parser.add_argument('--output', choices=['store', 'sheet', 'csv'], default='store',
+                        help="local store (synced by the GUI later), the sheet (through the store), or a CSV report")
+    parser.add_argument('--csv', default='batch_attendance.csv', help="report path for --output csv")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="recognition processes")
+    parser.add_argument('--every', type=int, default=5, help="process every Nth video frame")
+    parser.add_argument('--scale', type=float, default=0.25, help="downscale factor before detection")
+    parser.add_argument('--tolerance', type=float, default=0.6, help="maximum match distance")
+    parser.add_argument('--min-frames', type=int, default=2, help="frames a student must be matched in")
+    args = parser.parse_args(argv)
+
+    try:
+        timetable = Timetable.from_file('timetable.json')
+    except Exception as e:
+        print(f"Timetable error, using default slots: {str(e)}")
+        timetable = Timetable()
+    if args.lecture is not None and args.lecture not in timetable.columns:
+        parser.error(f"unknown lecture column {args.lecture}; expected one of {', '.join(timetable.columns)}")
+    try:
+        recorded_at = datetime.strptime(args.at, "%Y-%m-%d %H:%M") if args.at else None
+    except ValueError:
+        parser.error("--at must look like 'YYYY-MM-DD HH:MM'")
+    if not os.path.exists(args.source):
+        parser.error(f"{args.source} does not exist")
+
+    cache = EncodingCache('face_cache').load()
+    samples = {}
+    if os.path.isdir('images'):
+        samples, _ = load_reference_encodings('images', cache, max_workers=args.workers)
+    cache.save()
+    if not samples:
+        print("No enrolled faces found in images/")
+        return 1
+
+    batch = BatchAttendance({prn: list(encodings.values()) for prn, encodings in samples.items()},
+                            workers=args.workers, every=args.every, scale=args.scale,
+                            tolerance=args.tolerance, min_frames=args.min_frames,
+                            mode=ModernAttendanceSystem.MATCH_MODE, storage=ModernAttendanceSystem.GALLERY_STORAGE)
+    present = batch.run(args.source)
+
+    # A CSV report still uses the local roster for names and sections when there is one
+    store = AttendanceStore('attendance.db') if args.output != 'csv' or os.path.exists('attendance.db') else None
+    sheet = None
+    if args.output == 'sheet':
+        sheet, _ = open_attendance_sheet()
+        header, _, columns = split_sheet_values(sheet.get_all_values())
+        roster = {prn: {'name': name, 'section': section} for _, prn, name, section in sheet_roster(columns)}
+    elif store is not None:
+        roster = store.load_students(timetable.columns)
+    else:
+        roster = {}
+
+    def lecture_for(prn):
+        if args.lecture is not None:
+            return args.lecture
+        section = roster[prn]['section'] if prn in roster else Timetable.DEFAULT_SECTION
+        slot = timetable.slot_at(recorded_at, section)
+        if slot is None or (slot.room and timetable.kiosk_room and slot.room != timetable.kiosk_room):
+            return None
+        return slot.column
+
+    results = []
+    for prn, seen in sorted(present.items(), key=lambda item: item[1]['first_frame']):
+        name = roster[prn]['name'] if prn in roster else ''
+        results.append((prn, name, lecture_for(prn), seen))
+
+    marked = 0
+    if args.output == 'csv':
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['PRN', 'Name', 'Lecture', 'Status', 'Frames', 'First seen (s)', 'Best distance'])
+            for prn, name, lecture, seen in results:
+                first_seen = f"{seen['first_seen']:.1f}" if seen['first_seen'] is not None else ''
+                writer.writerow([prn, name, lecture or '', 'Present', seen['frames'], first_seen,
+                                 f"{seen['distance']:.3f}"])
+                marked += 1
+        print(f"Wrote {args.csv}")
+    else:
+        write_queue = SheetWriteQueue(sheet, SheetIndex(), on_written=store.ack) if sheet is not None else None
+        for prn, name, lecture, seen in results:
+            if prn not in roster:
+                print(f"Skipping PRN {prn}: not on the roster")
+            elif lecture is None:
+                print(f"Skipping {name} ({prn}): no lecture for their section at {args.at}")
+            else:
+                store.mark(prn, lecture)
+                if write_queue is not None:
+                    write_queue.mark(prn, lecture)
+                marked += 1
+        if write_queue is not None and not write_queue.flush():
+            print("Sheet write failed; marks stay in the local store and sync when the GUI next connects")
+    if store is not None:
+        store.close()
+
+    stats = batch.stats
+    fps = stats['processed'] / stats['elapsed_s'] if stats['elapsed_s'] else 0.0
+    print(f"Present: {marked} of {len(results)} recognised students")
+    print(f"Processed {stats['processed']} of {stats['read']} frames ({stats['faces']} faces, "
+          f"{stats['errors']} errors) in {stats['elapsed_s']:.1f}s: {fps:.1f} fps, "
+          f"{fps / batch.workers:.2f} fps per core on {batch.workers} workers")
+    return 0
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        sys.exit(batch_main(sys.argv[2:]))
     attendance_system = ModernAttendanceSystem()
     attendance_system.run()
@@ -0,0 +1,71 @@
+"""Recall/latency benchmark for IVFIndex against exact FaceGallery matching.
+
+Builds a synthetic 128-d gallery (identities scattered around a few thousand
+"look-alike" centres, which is closer to real face embeddings than isotropic
+noise), queries it with noisy copies of enrolled faces one face at a time, and
+reports recall@1 against the exact scan plus p50/p99 per-query latency for a
+sweep of nprobe values. Also times the incremental insert used by enrollment.
+
+Usage: python benchmarks/bench_ann.py [gallery_size] [queries]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from attendifyme import FaceGallery, IVFIndex  # noqa: E402
+
+
+def make_gallery(size, rng, centres=2000):
+    centre = rng.normal(0.0, 0.09, size=(centres, 128))
+    encodings = centre[rng.integers(0, centres, size)] + rng.normal(0.0, 0.04, size=(size, 128))
+    return {f"PRN{i:07d}": encodings[i] for i in range(size)}
+
+
+def query_times(gallery, queries):
+    times, prns = [], []
+    for query in queries:
+        start = time.perf_counter()
+        prns.append(gallery.match([query], tolerance=10.0)[0].prn)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return prns, times[len(times) // 2], times[int(len(times) * 0.99) - 1]
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    rng = np.random.default_rng(0)
+    known = make_gallery(size, rng)
+    prns = list(known)
+    picked = rng.choice(size, count, replace=False)
+    queries = [known[prns[i]] + rng.normal(0.0, 0.03, 128) for i in picked]
+
+    gallery = FaceGallery.from_encodings(known)
+    exact, p50, p99 = query_times(gallery, queries)
+    print(f"{size} identities, {count} single-face queries")
+    print(f"{'index':>14} {'recall@1':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    print(f"{'exact':>14} {1.0:>9.3f} {p50 * 1e3:>8.3f} {p99 * 1e3:>8.3f}")
+
+    start = time.perf_counter()
+    index = IVFIndex()
+    gallery.use_index(index)
+    build_s = time.perf_counter() - start
+    for nprobe in (1, 4, 8, 16, 32, 64):
+        index.nprobe = nprobe
+        found, p50, p99 = query_times(gallery, queries)
+        recall = np.mean([a == b for a, b in zip(found, exact)])
+        print(f"{f'ivf nprobe={nprobe}':>14} {recall:>9.3f} {p50 * 1e3:>8.3f} {p99 * 1e3:>8.3f}")
+    print(f"index build: {build_s:.1f}s for nlist={len(index.centroids)}")
+
+    inserts = rng.normal(0.0, 0.09, size=(1000, 128))
+    start = time.perf_counter()
+    for i, encoding in enumerate(inserts):
+        gallery.add(f"NEW{i:04d}", encoding)
+    print(f"incremental insert: {(time.perf_counter() - start) / len(inserts) * 1e6:.0f} us/face")
+
+
+if __name__ == '__main__':
+    main()
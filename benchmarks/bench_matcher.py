@@ -0,0 +1,58 @@
+"""Benchmark FaceGallery.match against the old per-student compare_faces loop.
+
+Usage: python benchmarks/bench_matcher.py [faces_per_frame]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import face_recognition
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from attendifyme import FaceGallery  # noqa: E402
+
+
+def make_roster(size, rng):
+    encodings = rng.normal(0.0, 0.09, size=(size, 128))
+    return {f"PRN{i:06d}": encodings[i] for i in range(size)}
+
+
+def loop_match(known, face_encodings):
+    """The matching loop process_face_recognition used before FaceGallery"""
+    matched = []
+    for face_encoding in face_encodings:
+        matches = []
+        for prn, known_encoding in known.items():
+            if face_recognition.compare_faces([known_encoding], face_encoding, tolerance=0.6)[0]:
+                matches.append(prn)
+        matched.append(matches)
+    return matched
+
+
+def best_time(fn, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    faces = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    rng = np.random.default_rng(0)
+    print(f"{'identities':>10} {'loop ms':>10} {'batched ms':>11} {'speedup':>8}")
+    for size in (100, 1_000, 10_000, 100_000):
+        known = make_roster(size, rng)
+        gallery = FaceGallery.from_encodings(known)
+        queries = [known[f"PRN{i:06d}"] + rng.normal(0.0, 0.01, 128) for i in range(faces)]
+
+        loop_repeats = 5 if size <= 10_000 else 1
+        loop_s = best_time(lambda: loop_match(known, queries), loop_repeats)
+        batched_s = best_time(lambda: gallery.match(queries), 20)
+        print(f"{size:>10} {loop_s * 1e3:>10.2f} {batched_s * 1e3:>11.3f} {loop_s / batched_s:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Recognition throughput of RecognitionPool against the number of worker processes.
+
+Several live camera feeds are simulated by PacedStream, a local stand-in for an
+RTSP camera: it has the cv2.VideoCapture read()/release() interface and hands out
+frames at a fixed frame rate by wall clock, dropping whatever is not read in time.
+Every frame is run through detection (no motion gate, detect_every=1) so the
+workload is the worst case, and the processed frames per second over all feeds
+are reported for each worker count.
+
+Usage: python benchmarks/bench_multicam.py [cameras] [seconds] [max_workers]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from attendifyme import CameraCapture, FaceGallery, RecognitionPool  # noqa: E402
+
+
+class PacedStream:
+    """Stand-in for a network camera: the newest of ``fps`` synthetic frames per second"""
+
+    def __init__(self, seed, fps=30, size=(640, 480), frames=32):
+        rng = np.random.default_rng(seed)
+        self.frames = [rng.integers(0, 255, size=(size[1], size[0], 3), dtype=np.uint8) for _ in range(frames)]
+        self.interval = 1.0 / fps
+        self.started = time.monotonic()
+        self.last = -1
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        index = int((time.monotonic() - self.started) / self.interval)
+        if index <= self.last:
+            time.sleep((index + 1) * self.interval - (time.monotonic() - self.started))
+            index += 1
+        self.last = index
+        return True, self.frames[index % len(self.frames)]
+
+    def release(self):
+        pass
+
+
+def run(cameras, workers, seconds, gallery):
+    captures = [CameraCapture(PacedStream(seed)).start() for seed in range(cameras)]
+    pool = RecognitionPool(captures, gallery, workers=workers, motion_gate=False, detect_every=1)
+    # Let the worker processes spawn before measuring
+    pool.executor.submit(time.sleep, 0).result()
+    pool.start()
+    time.sleep(1.0)
+    start_frames, start = pool.stats['processed'], time.perf_counter()
+    time.sleep(seconds)
+    frames = pool.stats['processed'] - start_frames
+    elapsed = time.perf_counter() - start
+    pool.stop()
+    return frames / elapsed
+
+
+def main():
+    cameras = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    max_workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count() or 1
+    rng = np.random.default_rng(0)
+    gallery = FaceGallery.from_encodings({f"PRN{i:05d}": rng.normal(0.0, 0.09, 128) for i in range(1000)})
+
+    print(f"{cameras} cameras at 30 fps, detection on every frame, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'frames/s':>9} {'speedup':>8}")
+    baseline = None
+    workers = 1
+    while workers <= max_workers:
+        fps = run(cameras, workers, seconds, gallery)
+        baseline = baseline or fps
+        print(f"{workers:>8} {fps:>9.1f} {fps / baseline:>7.2f}x")
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
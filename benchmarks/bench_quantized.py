@@ -0,0 +1,71 @@
+"""Memory and accuracy of quantized FaceGallery storage against float64 matching.
+
+Builds a synthetic 128-d gallery, matches noisy copies of enrolled faces plus
+faces of strangers, and for each storage dtype reports the gallery size, top-1
+agreement with an exact float64 scan on the enrolled faces, the distance error,
+how many accept/reject decisions at the default 0.6 tolerance change, and the
+latency of a 3-face match.
+
+Usage: python benchmarks/bench_quantized.py [gallery_size] [queries]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from attendifyme import FaceGallery  # noqa: E402
+
+TOLERANCE = 0.6
+
+
+def float64_match(known, queries):
+    """Best row and distance for each query with every value kept in float64"""
+    sq_norms = np.einsum('ij,ij->i', known, known)
+    best, best_dist = [], []
+    for start in range(0, len(queries), 64):
+        block = queries[start:start + 64]
+        sq = np.einsum('ij,ij->i', block, block)[:, None] + sq_norms[None, :] - 2.0 * (block @ known.T)
+        rows = np.argmin(sq, axis=1)
+        best.append(rows)
+        best_dist.append(np.sqrt(np.maximum(sq[np.arange(len(block)), rows], 0.0)))
+    return np.concatenate(best), np.concatenate(best_dist)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    rng = np.random.default_rng(0)
+    known = rng.normal(0.0, 0.09, size=(size, 128))
+    picked = rng.choice(size, count, replace=False)
+    queries = np.vstack([known[picked] + rng.normal(0.0, 0.03, size=(count, 128)),
+                         rng.normal(0.0, 0.09, size=(count // 2, 128))])
+    exact_rows, exact_dist = float64_match(known, queries)
+    exact_accept = exact_dist <= TOLERANCE
+
+    encodings = {f"PRN{i:06d}": known[i] for i in range(size)}
+    print(f"{size} identities, {len(queries)} queries ({count} enrolled, {count // 2} strangers)")
+    print(f"{'storage':>8} {'MB':>7} {'top-1 agree':>12} {'mean |dd|':>10} {'max |dd|':>9} "
+          f"{'flips':>6} {'3-face ms':>10}")
+    for storage in FaceGallery.STORAGE:
+        gallery = FaceGallery.from_encodings(encodings, storage=storage)
+        matches = gallery.match(queries, tolerance=np.inf)
+        rows = np.array([gallery.rows[m.prn] for m in matches])
+        dist = np.array([m.distance for m in matches])
+        error = np.abs(dist - exact_dist)
+        flips = np.count_nonzero((dist <= TOLERANCE) != exact_accept)
+        agree = np.mean(rows[:count] == exact_rows[:count])
+
+        frame = queries[:3]
+        times = []
+        for _ in range(20):
+            start = time.perf_counter()
+            gallery.match(frame)
+            times.append(time.perf_counter() - start)
+        print(f"{storage:>8} {gallery.nbytes / 1e6:>7.2f} {agree:>12.4f} "
+              f"{error.mean():>10.5f} {error.max():>9.5f} {flips:>6} {min(times) * 1e3:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Frame-time benchmark for draw_ui with 40 visible attendance rows.
+
+Compares full redraws that re-render every label with font.render (TextCache
+disabled) against the same redraws with a warm TextCache; both keep the row tile
+surfaces and only repaint the rows into them. Rebuilding the tiles from scratch
+(new surfaces, as after a resize or roster change) and idle frames where
+dirty-region tracking finds nothing to repaint are reported as rows of their own.
+Runs headless against a generated local sheet.
+
+Usage: python benchmarks/bench_render.py [frames]
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame  # noqa: E402
+from attendifyme import ModernAttendanceSystem, TextCache  # noqa: E402
+
+VISIBLE_ROWS = 40
+ROSTER_SIZE = 200
+
+
+def make_app(workdir):
+    sheet_path = os.path.join(workdir, 'sheet.csv')
+    with open(sheet_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['PRN'] + [f'Lecture{i}' for i in range(1, 9)] + ['Name'])
+        for i in range(ROSTER_SIZE):
+            status = 'Present' if i % 3 == 0 else 'Absent'
+            writer.writerow([f'2124UDSM{i:04d}'] + [status] * 8 + [f'Student {i}'])
+    os.environ['ATTENDIFY_LOCAL_SHEET'] = sheet_path
+
+    app = ModernAttendanceSystem()
+    # A tall offscreen canvas so the list shows VISIBLE_ROWS rows of 40 px
+    app.SCREEN_HEIGHT = 470 + 50 + VISIBLE_ROWS * 40
+    app.screen = pygame.Surface((app.SCREEN_WIDTH, app.SCREEN_HEIGHT))
+    return app
+
+
+def frame_times(app, frames, full_redraw=True, rebuild_tiles=False):
+    times = []
+    for _ in range(frames):
+        if full_redraw and app.row_tiles is not None:
+            # Repaint every row into the existing tiles, as the per-frame renderer drew each row
+            for _, signatures in app.row_tiles.tiles.values():
+                signatures[:] = [None] * len(signatures)
+        start = time.perf_counter()
+        app.full_redraw = full_redraw
+        if rebuild_tiles:
+            app.row_tiles = None
+        app.draw_ui()
+        app.dirty_rects = []
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2], times[int(len(times) * 0.99) - 1]
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        app = make_app(workdir)
+        try:
+            app.text_cache = TextCache(maxsize=0)
+            frame_times(app, 1)  # allocate the tiles
+            before = frame_times(app, frames)
+            app.text_cache = TextCache()
+            frame_times(app, 1)  # warm the cache
+            warm_misses = app.text_cache.stats['misses']
+            after = frame_times(app, frames)
+            print(f"{'':>12} {'median ms':>10} {'p99 ms':>8}")
+            print(f"{'no cache':>12} {before[0] * 1e3:>10.3f} {before[1] * 1e3:>8.3f}")
+            print(f"{'TextCache':>12} {after[0] * 1e3:>10.3f} {after[1] * 1e3:>8.3f}")
+            rebuild = frame_times(app, frames, rebuild_tiles=True)
+            print(f"{'tile rebuild':>12} {rebuild[0] * 1e3:>10.3f} {rebuild[1] * 1e3:>8.3f}")
+            app.message['expires'] = 0.0
+            frame_times(app, 1, full_redraw=False)
+            idle = frame_times(app, frames, full_redraw=False)
+            print(f"{'dirty rects':>12} {idle[0] * 1e3:>10.3f} {idle[1] * 1e3:>8.3f}")
+            steady_misses = app.text_cache.stats['misses'] - warm_misses
+            print(f"font.render calls in steady state: {steady_misses} over {frames} frames")
+        finally:
+            app.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Per-frame CPU of detecting faces on every frame against tracking them in between.
+
+A synthetic 640x480 scene with textured face-sized patches drifting across a
+noisy background is shrunk by the recognition scale (0.25) as RecognitionWorker
+does. The CPU time of one HOG detection on that frame is compared with one
+init and update (per face) of each box tracker available in this OpenCV build,
+together with how far the tracked box drifts from the true one between
+detections. The last column is the mean CPU per frame when HOG runs every
+``detect_every`` frames and the trackers follow the faces on the other frames;
+tracking only pays off when it is below the HOG row.
+
+Usage: python benchmarks/bench_tracking.py [faces] [frames] [detect_every]
+"""
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import face_recognition  # noqa: E402
+from attendifyme import FlowTracker  # noqa: E402
+
+SCALE = 0.25
+FACE = 160  # face size in the full-resolution frame
+
+
+def make_scene(faces, frames, rng):
+    """Small RGB frames plus the true (x, y, w, h) box of every face in each of them"""
+    background = cv2.GaussianBlur(rng.integers(0, 255, (480, 640, 3), dtype=np.uint8), (5, 5), 0)
+    patches = [cv2.GaussianBlur(rng.integers(0, 255, (FACE, FACE, 3), dtype=np.uint8), (3, 3), 0)
+               for _ in range(faces)]
+    starts = [(40 + 150 * i, 60 + 40 * (i % 2)) for i in range(faces)]
+    scene, truth = [], []
+    for t in range(frames):
+        frame = background.copy()
+        boxes = []
+        for (x0, y0), patch in zip(starts, patches):
+            x = int(x0 + 30 * np.sin(t / 15.0))
+            y = int(y0 + 20 * np.sin(t / 23.0))
+            frame[y:y + FACE, x:x + FACE] = patch
+            boxes.append((x * SCALE, y * SCALE, FACE * SCALE, FACE * SCALE))
+        small = cv2.resize(frame, (0, 0), fx=SCALE, fy=SCALE)
+        scene.append(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        truth.append(boxes)
+    return scene, truth
+
+
+def trackers():
+    available = [('FlowTracker', FlowTracker)]
+    for owner, name, label in ((getattr(cv2, 'legacy', None), 'TrackerMOSSE_create', 'MOSSE'),
+                               (cv2, 'TrackerKCF_create', 'KCF'),
+                               (cv2, 'TrackerMIL_create', 'MIL')):
+        factory = getattr(owner, name, None)
+        if factory is not None:
+            available.append((label, factory))
+    return available
+
+
+def track(factory, scene, truth, detect_every):
+    """Median CPU ms per face for a tracker init and update, and the mean centre error.
+
+    Trackers are re-created on the true boxes every ``detect_every`` frames, as
+    FaceTrack.reset does after each detection.
+    """
+    inits, updates, errors = [], [], []
+    for t, (frame, expected) in enumerate(zip(scene, truth)):
+        if t % detect_every == 0:
+            start = time.process_time()
+            boxes = [factory() for _ in expected]
+            for tracker, box in zip(boxes, expected):
+                tracker.init(frame, tuple(int(v) for v in box))
+            inits.append((time.process_time() - start) / len(expected))
+            continue
+        start = time.process_time()
+        results = [tracker.update(frame) for tracker in boxes]
+        updates.append((time.process_time() - start) / len(expected))
+        for (ok, (x, y, w, h)), (ex, ey, ew, eh) in zip(results, expected):
+            errors.append(np.hypot(x + w / 2 - ex - ew / 2, y + h / 2 - ey - eh / 2) if ok else np.nan)
+    inits.sort()
+    updates.sort()
+    return (inits[len(inits) // 2] * 1e3, updates[len(updates) // 2] * 1e3,
+            np.nanmean(errors), np.count_nonzero(np.isnan(errors)))
+
+
+def main():
+    faces = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    detect_every = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    scene, truth = make_scene(faces, frames, np.random.default_rng(0))
+
+    times = []
+    for frame in scene[:50]:
+        start = time.process_time()
+        face_recognition.face_locations(frame)
+        times.append(time.process_time() - start)
+    times.sort()
+    detect_ms = times[len(times) // 2] * 1e3
+
+    print(f"{faces} faces, {scene[0].shape[1]}x{scene[0].shape[0]} frames, HOG every {detect_every} frames")
+    print(f"{'':>12} {'init ms':>8} {'update ms':>10} {'drift px':>9} {'lost':>5} {'ms/frame':>9}")
+    print(f"{'HOG':>12} {'':>8} {'':>10} {'':>9} {'':>5} {detect_ms:>9.2f}")
+    for label, factory in trackers():
+        init_ms, update_ms, drift, lost = track(factory, scene, truth, detect_every)
+        per_frame = (detect_ms + faces * init_ms + (detect_every - 1) * faces * update_ms) / detect_every
+        print(f"{label:>12} {init_ms:>8.3f} {update_ms:>10.3f} {drift:>9.2f} {lost:>5} {per_frame:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""FaceGallery re-enrollment (_splice, IVFIndex.remove/shift/add) against a brute-force float64 scan."""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip('face_recognition')
+from attendifyme import FaceGallery, IVFIndex  # noqa: E402
+
+# Largest |stored - enrolled| per value for each storage dtype
+QUANTIZATION_ERROR = {'float32': 1e-6, 'float16': 1e-3, 'int8': 4e-3}
+
+
+def enrolled(seed=0, students=40):
+    rng = np.random.default_rng(seed)
+    return {f"PRN{i:03d}": list(rng.normal(0.0, 0.09, size=(1 + i % 3, 128))) for i in range(students)}
+
+
+def reenroll(gallery, encodings, rng):
+    """Grow, shrink and replace students in the middle of the packed rows, then add new ones"""
+    changes = {
+        'PRN010': rng.normal(0.0, 0.09, size=(4, 128)),  # 2 -> 4 samples
+        'PRN014': rng.normal(0.0, 0.09, size=(1, 128)),  # 3 -> 1
+        'PRN020': rng.normal(0.0, 0.09, size=(3, 128)),  # same count, new values
+        'PRN039': rng.normal(0.0, 0.09, size=(2, 128)),  # last student
+        'NEW000': rng.normal(0.0, 0.09, size=(2, 128)),
+        'NEW001': rng.normal(0.0, 0.09, size=(1, 128)),
+        'PRN000': rng.normal(0.0, 0.09, size=(3, 128)),  # first student
+    }
+    for prn, samples in changes.items():
+        gallery.add(prn, samples)
+        encodings[prn] = list(samples)
+
+
+def brute_force(gallery, queries):
+    """Best student row, its distance and the runner-up's, scanning the decoded rows in float64"""
+    rows = gallery.decode().astype(np.float64)
+    dists = np.linalg.norm(queries.astype(np.float64)[:, None, :] - rows[None, :, :], axis=2)
+    per_student = np.stack([dists[:, first:last].min(axis=1)
+                            for first, last in zip(gallery.offsets[:-1], gallery.offsets[1:])], axis=1)
+    order = np.argsort(per_student, axis=1)
+    picked = np.arange(len(queries))
+    return order[:, 0], per_student[picked, order[:, 0]], per_student[picked, order[:, 1]]
+
+
+@pytest.mark.parametrize('indexed', [False, True])
+@pytest.mark.parametrize('storage', FaceGallery.STORAGE)
+@pytest.mark.parametrize('mode', FaceGallery.MODES)
+def test_reenrollment_matches_brute_force(mode, storage, indexed):
+    rng = np.random.default_rng(1)
+    encodings = enrolled()
+    gallery = FaceGallery.from_encodings(encodings, mode=mode, storage=storage)
+    if indexed:
+        # Probing every cell makes the index exact, so it must agree with the scan
+        gallery.use_index(IVFIndex(nlist=4, nprobe=4))
+    reenroll(gallery, encodings, rng)
+
+    # Every student owns exactly its own (possibly averaged) samples, in order
+    assert len(gallery) == len(encodings)
+    for prn, samples in encodings.items():
+        student = gallery.rows[prn]
+        assert gallery.prns[student] == prn
+        first, last = gallery.offsets[student], gallery.offsets[student + 1]
+        expected = np.asarray(samples, dtype=np.float32)
+        if mode == 'centroid':
+            expected = expected.mean(axis=0, keepdims=True)
+        np.testing.assert_allclose(gallery.decode(first, last), expected, atol=QUANTIZATION_ERROR[storage])
+
+    prns = list(encodings)
+    picked = rng.choice(len(prns), 20, replace=False)
+    queries = np.vstack([np.asarray(encodings[prns[i]][0]) + rng.normal(0.0, 0.02, 128) for i in picked] +
+                        [rng.normal(0.0, 0.09, size=(5, 128))])
+    best, best_dist, second_dist = brute_force(gallery, queries)
+    matches = gallery.match(queries, tolerance=10.0)
+    assert [match.prn for match in matches] == [gallery.prns[student] for student in best]
+    np.testing.assert_allclose([match.distance for match in matches], best_dist, rtol=1e-4, atol=1e-5)
+    np.testing.assert_allclose([match.margin for match in matches], second_dist - best_dist, rtol=1e-4, atol=1e-5)